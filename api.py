@@ -1,15 +1,24 @@
+from shared.src.core.runtime import is_production, patch_for_production
+patch_for_production()
+import os
 from flask import Flask
 from flask_cors import CORS
 from gevent.pywsgi import WSGIServer
-import os
 import re
-from food_item.src.api.v1.api import app as app_food_item
-from user_info.src.api.v1.api import app as app_user_info
-from logged_item.src.api.v1.api import app as app_logged_item
+from food_item.src.api.v1.api import app as app_food_item, startup as startup_food_item
+from user_info.src.api.v1.api import app as app_user_info, startup as startup_user_info
+from logged_item.src.api.v1.api import app as app_logged_item, startup as startup_logged_item
+from logged_item.src.core.service_clients import use_transport as use_transport_logged_item
+from user_info.src.core.service_clients import use_transport as use_transport_user_info
 
 app: Flask = Flask(__name__)
 CORS(app)
 
+# Services share this process, so by default they call each other directly instead of over HTTP
+SERVICE_TRANSPORT: str = os.environ.get("SERVICE_TRANSPORT", "inprocess").lower()
+use_transport_logged_item(SERVICE_TRANSPORT)
+use_transport_user_info(SERVICE_TRANSPORT)
+
 # Register routes from app_food_item
 for rule in app_food_item.url_map.iter_rules():
     if rule.endpoint in ["home", "static"]:
@@ -50,11 +59,13 @@ for rule in app_logged_item.url_map.iter_rules():
     )
 
 if __name__ == "__main__":
-    environment: str = os.environ.get("ENVIRONMENT", "development").lower()
+    startup_food_item()
+    startup_user_info()
+    startup_logged_item()
     debug: bool = (os.environ.get("FLASK_DEBUG", "True").lower() != "false")
     host: str = os.environ.get("FLASK_HOST", "0.0.0.0")
     port: int = int(os.environ.get("FLASK_PORT", 5000))
-    if environment in ["prod", "production"]:
+    if is_production():
         http_server = WSGIServer((host, port), app)
         http_server.serve_forever()
     else:
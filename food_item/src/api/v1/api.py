@@ -1,18 +1,23 @@
+from shared.src.core.runtime import is_production, patch_for_production
+patch_for_production()
 import os
 from flask import Response, jsonify
 from flask_cors import CORS
 from gevent.pywsgi import WSGIServer
 from mongoengine import connect, get_connection
 from dotenv import load_dotenv
-from food_item.src.core.manage_food_item import check_calorie_ninjas_api_status, get_nutrition_facts
+from food_item.src.core.manage_food_item import FOOD_NAME_INDEX, batch_results_to_dict, check_calorie_ninjas_api_status, get_nutrition_facts, get_nutrition_facts_batch, search_food_names
 from food_item.src.models.converters.food_item_converter import FoodItemConverter
 from food_item.src.models.entities.food_item import FoodItem
+from food_item.src.models.entities.circuit_breaker import CircuitBreaker
+from food_item.src.models.entities.unknown_food import UnknownFood
 from pydantic import BaseModel, Field
 from flask_openapi3.openapi import OpenAPI
 from flask_openapi3.models.info import Info
 from flask_openapi3.models.tag import Tag
 from prometheus_client import make_wsgi_app, Counter, Histogram
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from shared.src.core.health import HealthMonitor
 import time
 
 load_dotenv()
@@ -24,6 +29,8 @@ connect(
     password=os.environ["MONGO_PASSWORD"],
     uuidRepresentation="standard",
 )
+BATCH_MAX_QUERIES: int = int(os.environ.get("FOOD_ITEM_BATCH_MAX_QUERIES", 100))
+SEARCH_MAX_LIMIT: int = 100
 info: Info = Info(title="Food item microservice API", version="1.0.0")
 app: OpenAPI = OpenAPI(__name__, info=info, doc_prefix="/food_item/openapi")
 CORS(app)
@@ -32,6 +39,7 @@ app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {
 })
 
 TAG_QUERY: Tag = Tag(name="Query", description="Return nutrition facts about the given food")
+TAG_SEARCH: Tag = Tag(name="Search", description="Autocomplete known food names")
 TAG_HEALTH: Tag = Tag(name="Health", description="Health checking probes")
 
 class QueryPath(BaseModel):
@@ -61,6 +69,27 @@ class QueryResponseNotFound(BaseModel):
 class QueryResponseError(BaseModel):
     error: str = Field("HTTPSConnectionPool(host='api.calorieninjas.com', port=443): Max retries exceeded with url: ...")
 
+class BatchQueryBody(BaseModel):
+    queries: list[str] = Field(["banana", "rice"], description="Queries (food names)")
+
+class BatchQueryResultPydantic(BaseModel):
+    food_item: FoodItemPydantic | None = Field(None, description="Nutrition facts, if the query was successful")
+    error: str | None = Field(None, description="Error message, if the query failed")
+    status: int = Field(200, description="HTTP status of this individual query")
+
+class BatchQueryResponse(BaseModel):
+    food_items: dict[str, BatchQueryResultPydantic] = Field(..., description="Results, keyed by the queries as they were sent")
+
+class BatchQueryResponseError(BaseModel):
+    error: str = Field("Too many queries: ...", description="Error message")
+
+class SearchQuery(BaseModel):
+    prefix: str = Field(..., description="Beginning of the food name")
+    limit: int = Field(10, ge=1, le=SEARCH_MAX_LIMIT, description="Max number of returned names")
+
+class SearchResponse(BaseModel):
+    names: list[str] = Field(["banana", "banana bread"], description="Known food names starting with the given prefix, in alphabetical order")
+
 class HomeResponse(BaseModel):
     message: str = Field("Hello, this is the root endpoint of food_item", description="Greeting")
 
@@ -87,6 +116,15 @@ REQ_LATENCY: Histogram = Histogram(
     ["method", "endpoint"],
 )
 
+HEALTH_MONITOR: HealthMonitor = HealthMonitor(
+    service="food_item",
+    interval=float(os.environ.get("HEALTH_CHECK_INTERVAL", 10)),
+    max_staleness=float(os.environ.get("HEALTH_CHECK_MAX_STALENESS", 30)),
+    timeout=float(os.environ.get("HEALTH_CHECK_TIMEOUT", 5)),
+)
+HEALTH_MONITOR.add_check("database", lambda: get_connection().server_info(), 503, "Database not available: ")
+HEALTH_MONITOR.add_check("calorie_ninjas_api", check_calorie_ninjas_api_status, 504)
+
 @app.get(
     "/api/v1/",
     responses={
@@ -118,6 +156,42 @@ def food_item(path: QueryPath):
     REQ_LATENCY.labels("GET", "/api/v1/food_item/<string:query>").observe(time.time() - time_start)
     return response
 
+@app.post(
+    "/api/v1/food_item/batch",
+    tags=[TAG_QUERY],
+    summary="Get nutrition facts about several food items at once",
+    responses={
+        200: BatchQueryResponse,
+        400: BatchQueryResponseError,
+    }
+)
+def food_item_batch(body: BatchQueryBody):
+    time_start: float = time.time()
+    response: tuple[Response, int] = jsonify({}), 0
+    if len(body.queries) > BATCH_MAX_QUERIES:
+        response = jsonify({"error": f"Too many queries: {len(body.queries)} (max {BATCH_MAX_QUERIES})"}), 400
+    else:
+        results: dict[str, FoodItem | tuple[str, int]] = get_nutrition_facts_batch(body.queries)
+        response = jsonify({"food_items": batch_results_to_dict(body.queries, results)}), 200
+    REQ_COUNT.labels("POST", "/api/v1/food_item/batch", response[1]).inc()
+    REQ_LATENCY.labels("POST", "/api/v1/food_item/batch").observe(time.time() - time_start)
+    return response
+
+@app.get(
+    "/api/v1/food_item/search",
+    tags=[TAG_SEARCH],
+    summary="Get known food names starting with the given prefix",
+    responses={
+        200: SearchResponse,
+    }
+)
+def food_item_search(query: SearchQuery):
+    time_start: float = time.time()
+    response: tuple[Response, int] = jsonify({"names": search_food_names(query.prefix, query.limit)}), 200
+    REQ_COUNT.labels("GET", "/api/v1/food_item/search", response[1]).inc()
+    REQ_LATENCY.labels("GET", "/api/v1/food_item/search").observe(time.time() - time_start)
+    return response
+
 @app.get(
     "/api/v1/food_item/health/live",
     tags=[TAG_HEALTH],
@@ -140,24 +214,28 @@ def food_item_liveness_probe():
     },
 )
 def food_item_readiness_probe():
-    # Check database availability
-    try:
-        get_connection().server_info()
-    except Exception as e:
-        return jsonify({"error": f"Database not available: {str(e)}"}), 503
-    # Check calorie ninjas API
-    try:
-        check_calorie_ninjas_api_status()
-    except Exception as e:
-        return jsonify({"error": str(e)}), 504
+    # Check database and calorie ninjas API availability (results of background checks)
+    error: tuple[str, int] | None = HEALTH_MONITOR.readiness()
+    if error is not None:
+        return jsonify({"error": error[0]}), error[1]
     return jsonify({"message": "Readiness probe successful"}), 200
 
+def startup():
+    # Make sure that all collections are indexed
+    for document in [FoodItem, CircuitBreaker, UnknownFood]:
+        document.ensure_indexes()
+    # Warm up in-memory state before serving requests
+    FOOD_NAME_INDEX.load()
+    # Background health checks need gevent's hub, which only runs under the patched WSGIServer
+    if is_production():
+        HEALTH_MONITOR.start()
+
 if __name__ == "__main__":
-    environment: str = os.environ.get("ENVIRONMENT", "development").lower()
+    startup()
     debug: bool = (os.environ.get("FLASK_DEBUG", "True").lower() != "false")
     host: str = os.environ.get("FLASK_HOST", "0.0.0.0")
     port: int = int(os.environ.get("FLASK_PORT", 5000))
-    if environment in ["prod", "production"]:
+    if is_production():
         http_server = WSGIServer((host, port), app)
         http_server.serve_forever()
     else:
@@ -0,0 +1,143 @@
+from typing import Any, Iterator, TextIO
+from mongoengine import connect
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+from food_item.src.models.converters.food_item_converter import FoodItemConverter
+from food_item.src.models.entities.food_item import FoodItem
+import argparse
+import csv
+import gzip
+import json
+import math
+import os
+import sys
+import time
+
+BATCH_SIZE_DEFAULT: int = 1000
+FORMATS: list[str] = ["csv", "jsonl"]
+# Every key (and alias) that FoodItemConverter reads as a number
+NUMERIC_COLUMNS: set[str] = {
+    "serving_size_g", "weight_g", "calories",
+    "fat_total_g", "fat_total", "fat_saturated_g", "fat_saturated",
+    "protein_g", "protein", "carbohydrates_total_g", "carbohydrates",
+    "fiber_g", "fiber", "sugar_g", "sugar",
+    "sodium_mg", "sodium", "potassium_mg", "potassium", "cholesterol_mg", "cholesterol",
+}
+
+def open_input(path: str) -> TextIO:
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, mode="rt", encoding="utf-8", newline="")
+    return open(path, mode="r", encoding="utf-8", newline="")
+
+def detect_format(path: str) -> str:
+    name: str = path[:-len(".gz")] if path.endswith(".gz") else path
+    return "jsonl" if name.endswith((".jsonl", ".ndjson")) else "csv"
+
+def parse_value(value: Any) -> float:
+    # CSV cells are always strings, nutrient values must be (finite) numbers
+    number: float = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"Value is not a finite number: {value}")
+    return number
+
+def read_rows(stream: TextIO, input_format: str) -> Iterator[dict[str, str] | str]:
+    # Raw rows are yielded one at a time, so memory use does not depend on input size
+    # (parsing is left to parse_row, so one malformed row does not abort the import)
+    if input_format == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield line
+
+def parse_row(raw: dict[str, str] | str) -> dict[str, Any]:
+    if isinstance(raw, str):
+        row: Any = json.loads(raw)
+        if not isinstance(row, dict):
+            raise ValueError("Row is not a JSON object")
+        return row
+    # Only nutrient and weight columns are numbers, names like "100" or "nan" stay strings
+    return {
+        key: parse_value(value) if key in NUMERIC_COLUMNS else value
+        for key, value in raw.items() if key is not None and value != ""
+    }
+
+def row_to_update(raw: dict[str, str] | str) -> UpdateOne:
+    row: dict[str, Any] = parse_row(raw)
+    # Reuses the converter's key aliases (e.g. serving_size_g/weight_g) and weight normalization
+    row.pop("id", None)
+    document: dict[str, Any] = FoodItemConverter.to_entity(row).to_mongo().to_dict()
+    document.pop("_id", None)
+    return UpdateOne({"name": document["name"]}, {"$set": document}, upsert=True)
+
+def flush(collection: Collection, operations: list[UpdateOne], stats: dict[str, int]):
+    if not operations:
+        return
+    try:
+        result = collection.bulk_write(operations, ordered=False)
+        stats["upserted"] += result.upserted_count
+        stats["modified"] += result.modified_count
+    except BulkWriteError as e:
+        stats["upserted"] += e.details.get("nUpserted", 0)
+        stats["modified"] += e.details.get("nModified", 0)
+        stats["failed"] += len(e.details.get("writeErrors", []))
+    operations.clear()
+
+def report(stats: dict[str, int], time_start: float, final: bool = False):
+    elapsed: float = max(time.time() - time_start, 1e-9)
+    print(
+        f"{'Done' if final else 'Progress'}: "
+        f"{stats['read']} rows read, {stats['upserted']} inserted, {stats['modified']} updated, "
+        f"{stats['skipped']} skipped, {stats['failed']} failed "
+        f"({stats['read'] / elapsed:.0f} rows/s, {elapsed:.1f}s)",
+        file=sys.stderr,
+    )
+
+def import_catalog(stream: TextIO, input_format: str, batch_size: int) -> dict[str, int]:
+    collection: Collection = FoodItem._get_collection()
+    stats: dict[str, int] = {"read": 0, "upserted": 0, "modified": 0, "skipped": 0, "failed": 0}
+    operations: list[UpdateOne] = []
+    time_start: float = time.time()
+    for raw in read_rows(stream, input_format):
+        stats["read"] += 1
+        try:
+            operations.append(row_to_update(raw))
+        except (AttributeError, KeyError, TypeError, ValueError, ZeroDivisionError) as e:
+            stats["skipped"] += 1
+            print(f"Skipping row {stats['read']}: {str(e)}", file=sys.stderr)
+            continue
+        if len(operations) >= batch_size:
+            flush(collection, operations, stats)
+            report(stats, time_start)
+    flush(collection, operations, stats)
+    report(stats, time_start, final=True)
+    return stats
+
+def main():
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Import (upsert) food items from a local CSV/JSONL nutrient dataset")
+    parser.add_argument("path", help="Path to the dataset (optionally gzipped), or - for standard input")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="Input format (detected from file extension by default)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE_DEFAULT, help="Number of upserts sent to MongoDB at once")
+    args: argparse.Namespace = parser.parse_args()
+
+    load_dotenv()
+    connect(
+        db=os.environ["MONGO_DB_NAME"],
+        host=os.environ["MONGO_HOST"],
+        port=int(os.environ["MONGO_PORT"]),
+        username=os.environ["MONGO_USERNAME"],
+        password=os.environ["MONGO_PASSWORD"],
+        uuidRepresentation="standard",
+    )
+    input_format: str = args.format or detect_format(args.path)
+    with open_input(args.path) as stream:
+        stats: dict[str, int] = import_catalog(stream, input_format, args.batch_size)
+    if stats["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,190 @@
+from collections import deque
+from prometheus_client import Counter, Gauge
 import time
+import random
+import threading
+import gevent
 from food_item.src.models.entities.circuit_breaker import CircuitBreaker, CircuitBreakerState
 
-TIMEOUT_SECONDS: int = 30
-
-def get_latest_cb(event_name: str) -> CircuitBreaker | None:
-    return CircuitBreaker.objects(event_name=event_name).order_by("-timestamp").first()
-
-def get_cb_state(circuit_breaker: CircuitBreaker | None) -> CircuitBreakerState:
-    if circuit_breaker is None or circuit_breaker.state == CircuitBreakerState.CLOSED:
-        return CircuitBreakerState.CLOSED
-    min_timestamp: float = time.time() - TIMEOUT_SECONDS
-    if circuit_breaker.timestamp > min_timestamp:
-        return CircuitBreakerState.OPEN
-    else:
-        return CircuitBreakerState.HALF_OPEN
-
-def trip_cb(event_name: str):
-    # Create new open circuit breaker entity
-    circuit_breaker: CircuitBreaker = CircuitBreaker(
-        state=CircuitBreakerState.OPEN,
-        event_name=event_name,
-        timestamp=time.time(),
-    )
-    circuit_breaker.save()
-
-def update_old_open_cb():
-    # If a circuit breaker has been open for >TIMEOUT_SECONDS, the change it to half-open
-    min_timestamp: float = time.time() - TIMEOUT_SECONDS
-    CircuitBreaker.objects(timestamp__lt=min_timestamp, state=CircuitBreakerState.OPEN).update(set__state=CircuitBreakerState.HALF_OPEN)
-
-def update_half_open_cb(cb: CircuitBreaker, success: bool):
-    # Update state of half open circuit breaker according to success of related operation
-    cb.reload()
-    if cb.state in [CircuitBreakerState.OPEN, CircuitBreakerState.HALF_OPEN]:
-        new_state: CircuitBreakerState = CircuitBreakerState.CLOSED if success else CircuitBreakerState.OPEN
-        cb.update(set__state=new_state)
+RETRYABLE_STATUS_CODES: set[int] = {408, 429, 500, 502, 503, 504}
 
+class RetryPolicy():
+    # Exponential backoff with jitter, bounded by a total deadline for all attempts
+    def __init__(
+        self,
+        attempts: int,
+        base_delay: float,
+        max_delay: float,
+        jitter: float,
+        deadline: float,
+        connect_timeout: float,
+        read_timeout: float,
+    ):
+        self.attempts: int = attempts
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.jitter: float = jitter
+        self.deadline: float = deadline
+        self.connect_timeout: float = connect_timeout
+        self.read_timeout: float = read_timeout
+
+    def start(self) -> float:
+        # Returns the (monotonic) time by which all attempts must finish
+        return time.monotonic() + self.deadline
+
+    def remaining(self, deadline_at: float) -> float:
+        return max(0.0, deadline_at - time.monotonic())
+
+    def timeouts(self, deadline_at: float) -> tuple[float, float]:
+        # Per-attempt (connect, read) timeouts, never exceeding what is left of the deadline
+        remaining: float = self.remaining(deadline_at)
+        return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+    def backoff(self, attempt: int) -> float:
+        delay: float = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (1.0 - self.jitter) + random.uniform(0.0, delay * self.jitter)
+
+    def is_retryable(self, status_code: int) -> bool:
+        return status_code in RETRYABLE_STATUS_CODES
+
+    def wait(self, attempt: int, deadline_at: float) -> bool:
+        # Sleep before the next attempt; returns False if there is no next attempt worth making
+        if attempt >= self.attempts - 1:
+            return False
+        delay: float = self.backoff(attempt)
+        if delay >= self.remaining(deadline_at):
+            return False
+        # Yields to other greenlets instead of blocking the whole server
+        gevent.sleep(delay)
+        return True
+
+CB_STATE_VALUES: dict[CircuitBreakerState, int] = {
+    CircuitBreakerState.CLOSED: 0,
+    CircuitBreakerState.HALF_OPEN: 1,
+    CircuitBreakerState.OPEN: 2,
+}
+CB_STATE: Gauge = Gauge(
+    "food_item_circuit_breaker_state",
+    "Microservice food_item Circuit Breaker State (0 = closed, 1 = half open, 2 = open)",
+    ["event_name"],
+)
+CB_TRANSITION_COUNT: Counter = Counter(
+    "food_item_circuit_breaker_transition_count",
+    "Microservice food_item Circuit Breaker Transition Count",
+    ["event_name", "from_state", "to_state"],
+)
+
+class LocalCircuitBreaker():
+    # Process-local circuit breaker; MongoDB is only written on state changes and
+    # read every sync_interval seconds to pick up transitions made by other replicas
+    def __init__(
+        self,
+        event_name: str,
+        failure_rate_threshold: float,
+        minimum_calls: int,
+        window_size: int,
+        open_timeout: float,
+        half_open_max_probes: int,
+        sync_interval: float,
+        retention: float,
+    ):
+        self.event_name: str = event_name
+        self.failure_rate_threshold: float = failure_rate_threshold
+        self.minimum_calls: int = minimum_calls
+        self.open_timeout: float = open_timeout
+        self.half_open_max_probes: int = half_open_max_probes
+        self.sync_interval: float = sync_interval
+        self.retention: float = retention
+        self.state: CircuitBreakerState = CircuitBreakerState.CLOSED
+        self.state_since: float = 0.0
+        self.outcomes: deque[bool] = deque(maxlen=window_size)
+        self.probes_in_flight: int = 0
+        self.probe_successes: int = 0
+        self.last_sync: float = 0.0
+        self._pending: list[tuple[CircuitBreakerState, float]] = []
+        self._lock: threading.Lock = threading.Lock()
+        CB_STATE.labels(event_name).set(CB_STATE_VALUES[self.state])
+
+    def allow_request(self) -> bool:
+        self.sync()
+        allowed: bool = True
+        with self._lock:
+            if self.state == CircuitBreakerState.OPEN:
+                if time.time() - self.state_since < self.open_timeout:
+                    allowed = False
+                else:
+                    self._transition(CircuitBreakerState.HALF_OPEN)
+            if allowed and self.state == CircuitBreakerState.HALF_OPEN:
+                if self.probes_in_flight >= self.half_open_max_probes:
+                    allowed = False
+                else:
+                    self.probes_in_flight += 1
+        self._persist_pending()
+        return allowed
+
+    def record(self, success: bool):
+        with self._lock:
+            if self.state == CircuitBreakerState.HALF_OPEN:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+                if not success:
+                    self._transition(CircuitBreakerState.OPEN)
+                else:
+                    self.probe_successes += 1
+                    if self.probe_successes >= self.half_open_max_probes:
+                        self._transition(CircuitBreakerState.CLOSED)
+            elif self.state == CircuitBreakerState.CLOSED:
+                self.outcomes.append(success)
+                failures: int = self.outcomes.count(False)
+                if len(self.outcomes) >= self.minimum_calls and failures / len(self.outcomes) >= self.failure_rate_threshold:
+                    self._transition(CircuitBreakerState.OPEN)
+        self._persist_pending()
+
+    def sync(self):
+        # Adopt newer open/closed states persisted by other replicas
+        now: float = time.time()
+        if now - self.last_sync < self.sync_interval:
+            return
+        self.last_sync = now
+        try:
+            latest: CircuitBreaker | None = CircuitBreaker.objects(event_name=self.event_name).order_by("-timestamp").first()
+        except Exception:
+            return
+        if latest is None or latest.timestamp <= self.state_since or latest.state == CircuitBreakerState.HALF_OPEN:
+            return
+        with self._lock:
+            if latest.state != self.state:
+                self._transition(latest.state, since=latest.timestamp, persist=False)
+
+    def _transition(self, new_state: CircuitBreakerState, since: float | None = None, persist: bool = True):
+        # Must be called with the lock held; the transition is persisted by _persist_pending once the lock is released
+        old_state: CircuitBreakerState = self.state
+        self.state = new_state
+        self.state_since = time.time() if since is None else since
+        self.outcomes.clear()
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        CB_STATE.labels(self.event_name).set(CB_STATE_VALUES[new_state])
+        CB_TRANSITION_COUNT.labels(self.event_name, old_state.value, new_state.value).inc()
+        if persist:
+            self._pending.append((new_state, self.state_since))
+
+    def _persist_pending(self):
+        # Database IO happens outside the lock, so requests checking the breaker never wait for it
+        with self._lock:
+            pending: list[tuple[CircuitBreakerState, float]] = self._pending
+            self._pending = []
+        for state, since in pending:
+            self._persist(state, since)
+
+    def _persist(self, state: CircuitBreakerState, since: float):
+        # Record the transition and compact breaker documents older than the retention period
+        try:
+            CircuitBreaker(
+                state=state,
+                event_name=self.event_name,
+                timestamp=since,
+            ).save()
+            CircuitBreaker.objects(event_name=self.event_name, timestamp__lt=since - self.retention).delete()
+        except Exception:
+            # Shared state is best effort, the local breaker keeps working without it
+            pass
@@ -1,40 +1,156 @@
 from typing import Any, cast
-import requests
 from requests import Response
 import dotenv
 import os
 import json
-import time
-from food_item.src.core.fault_tolerance import get_cb_state, get_latest_cb, trip_cb, update_half_open_cb
+from food_item.src.core.fault_tolerance import LocalCircuitBreaker, RetryPolicy
+from food_item.src.core.search_index import PrefixIndex
 from food_item.src.models.converters.food_item_converter import FoodItemConverter
-from food_item.src.models.entities.circuit_breaker import CircuitBreaker, CircuitBreakerState
 from food_item.src.models.entities.food_item import FoodItem
+from food_item.src.models.entities.unknown_food import UnknownFood
+from shared.src.core.cache import TTLCache
+from shared.src.core.http_client import HTTP_CLIENT
+from shared.src.core.single_flight import SingleFlight
+from mongoengine import NotUniqueError
+from pymongo.errors import BulkWriteError
+from pymongo.results import InsertManyResult
+from pymongo import UpdateOne
+import datetime
 
 RESPONSE_ENCODING: str = "utf-8"
-EXTERNAL_API_RETRY: int = 3
-EXTERNAL_API_DELAY: int = 3
 EXTERNAL_API_EVENT_NAME: str = "calorie_ninjas_api"
+EXTERNAL_API_MAX_QUERY_LENGTH: int = 1500
+EXTERNAL_API_MAX_QUERY_ITEMS: int = 20
+EXTERNAL_API_QUERY_SEPARATOR: str = ", "
 
 dotenv.load_dotenv()
 
+FOOD_ITEM_CACHE: TTLCache[str, FoodItem] = TTLCache(
+    name="food_item",
+    maxsize=int(os.environ.get("FOOD_ITEM_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("FOOD_ITEM_CACHE_TTL", 3600)),
+)
+UNKNOWN_FOOD_TTL: float = float(os.environ.get("UNKNOWN_FOOD_CACHE_TTL", 900))
+UNKNOWN_FOOD_CACHE: TTLCache[str, bool] = TTLCache(
+    name="unknown_food",
+    maxsize=int(os.environ.get("UNKNOWN_FOOD_CACHE_SIZE", 4096)),
+    ttl=UNKNOWN_FOOD_TTL,
+)
+UNKNOWN_FOOD_RESPONSE: str = json.dumps({"items": []})
+EXTERNAL_API_RETRY_POLICY: RetryPolicy = RetryPolicy(
+    attempts=int(os.environ.get("EXTERNAL_API_RETRY_ATTEMPTS", 3)),
+    base_delay=float(os.environ.get("EXTERNAL_API_RETRY_BASE_DELAY", 0.5)),
+    max_delay=float(os.environ.get("EXTERNAL_API_RETRY_MAX_DELAY", 3.0)),
+    jitter=float(os.environ.get("EXTERNAL_API_RETRY_JITTER", 0.5)),
+    deadline=float(os.environ.get("EXTERNAL_API_DEADLINE", 8.0)),
+    connect_timeout=float(os.environ.get("EXTERNAL_API_CONNECT_TIMEOUT", 2.0)),
+    read_timeout=float(os.environ.get("EXTERNAL_API_READ_TIMEOUT", 5.0)),
+)
+EXTERNAL_API_CIRCUIT_BREAKER: LocalCircuitBreaker = LocalCircuitBreaker(
+    event_name=EXTERNAL_API_EVENT_NAME,
+    failure_rate_threshold=float(os.environ.get("EXTERNAL_API_CB_FAILURE_RATE", 0.5)),
+    minimum_calls=int(os.environ.get("EXTERNAL_API_CB_MINIMUM_CALLS", 3)),
+    window_size=int(os.environ.get("EXTERNAL_API_CB_WINDOW_SIZE", 10)),
+    open_timeout=float(os.environ.get("EXTERNAL_API_CB_OPEN_TIMEOUT", 30)),
+    half_open_max_probes=int(os.environ.get("EXTERNAL_API_CB_HALF_OPEN_PROBES", 1)),
+    sync_interval=float(os.environ.get("EXTERNAL_API_CB_SYNC_INTERVAL", 5)),
+    retention=float(os.environ.get("EXTERNAL_API_CB_RETENTION", 7 * 24 * 3600)),
+)
+FOOD_NAME_INDEX: PrefixIndex = PrefixIndex(
+    loader=lambda: (document["name"] for document in FoodItem._get_collection().find({}, {"name": 1, "_id": 0})),
+)
+FOOD_ITEM_FLIGHTS: SingleFlight[str, FoodItem | tuple[str, int]] = SingleFlight(name="food_item")
+
+def normalize_query(query: str) -> str:
+    return query.strip().lower()
+
 def check_existing_records(query: str) -> FoodItem | None:
-    result: list[FoodItem] | None = FoodItem.objects(name=query.lower())
-    return result[0] if result else None
+    result: list[FoodItem] | None = FoodItem.objects(name=normalize_query(query))
+    if not result:
+        return None
+    # Items saved by other replicas also become searchable once they are looked up here
+    FOOD_NAME_INDEX.add(result[0].name)
+    return result[0]
+
+def search_food_names(prefix: str, limit: int) -> list[str]:
+    return FOOD_NAME_INDEX.search(normalize_query(prefix), limit)
+
+def check_unknown_records(names: list[str]) -> set[str]:
+    # Names that the external API recently reported as unknown (shared across replicas)
+    now: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+    unknown: set[str] = {unknown_food.name for unknown_food in UnknownFood.objects(name__in=names, expires_at__gt=now).only("name")}
+    for name in unknown:
+        UNKNOWN_FOOD_CACHE.set(name, True)
+    return unknown
+
+def remember_unknown(names: list[str]):
+    if not names:
+        return
+    expires_at: datetime.datetime = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=UNKNOWN_FOOD_TTL)
+    for name in names:
+        UNKNOWN_FOOD_CACHE.set(name, True)
+    UnknownFood._get_collection().bulk_write(
+        [UpdateOne({"name": name}, {"$set": {"expires_at": expires_at}}, upsert=True) for name in names],
+        ordered=False,
+    )
 
 def check_calorie_ninjas_api_status():
     # Sadly, it doesn't have ANY status/health endpoint
     url: str = "https://api.calorieninjas.com"
     try:
-        requests.get(url=url, timeout=5)
+        HTTP_CLIENT.get(url, "calorie_ninjas", timeout=5)
     except Exception as e:
         raise Exception(f"Timeout reached when reaching Calorie Ninjas API {str(e)}")
 
 def get_nutrition_facts(query: str) -> FoodItem | tuple[str, int]:
-    # Return cached record if it exists
+    # Serve hot lookups from memory, without touching the database
+    cache_key: str = normalize_query(query)
+    cached_item: FoodItem | None = FOOD_ITEM_CACHE.get(cache_key)
+    if cached_item is not None:
+        return cached_item
+    # Answer recently unknown foods locally, without spending API quota
+    if UNKNOWN_FOOD_CACHE.get(cache_key):
+        return UNKNOWN_FOOD_RESPONSE, 404
+    # Concurrent misses for the same food share a single lookup (and a single insert)
+    return FOOD_ITEM_FLIGHTS.do(cache_key, lambda: fetch_nutrition_facts(query))
+
+def fetch_nutrition_facts(query: str) -> FoodItem | tuple[str, int]:
+    cache_key: str = normalize_query(query)
+
+    # Return stored record if it exists
     cached_record: FoodItem | None = check_existing_records(query)
     if cached_record:
+        FOOD_ITEM_CACHE.set(cache_key, cached_record)
         return cached_record
+    if check_unknown_records([cache_key]):
+        return UNKNOWN_FOOD_RESPONSE, 404
+
+    # Get nutrition facts from external API
+    content: dict[str, Any] | tuple[str, int] = request_calorie_ninjas(query)
+    if isinstance(content, tuple):
+        return content
+    if len(content["items"]) < 1:
+        remember_unknown([cache_key])
+        return UNKNOWN_FOOD_RESPONSE, 404
+    try:
+        food_item: FoodItem = FoodItemConverter.to_entity(content["items"][0])
+    except KeyError as e:
+        return f"Error: Failed to convert food item from API response: {str(e)}", 500
+    existing_item: FoodItem | None = check_existing_records(food_item.name)
+    if existing_item:
+        food_item = existing_item
+    else:
+        try:
+            food_item.save()
+        except NotUniqueError:
+            # Another replica inserted the same food in the meantime
+            food_item = cast(FoodItem, check_existing_records(food_item.name))
+    FOOD_NAME_INDEX.add(food_item.name)
+    FOOD_ITEM_CACHE.set(cache_key, food_item)
+    FOOD_ITEM_CACHE.set(food_item.name, food_item)
+    return food_item
 
+def request_calorie_ninjas(query: str) -> dict[str, Any] | tuple[str, int]:
     # Prepare request data
     api_key: str = os.environ["CALORIE_NINJAS_API_KEY"]
     url: str = "https://api.calorieninjas.com/v1/nutrition"
@@ -46,51 +162,148 @@ def get_nutrition_facts(query: str) -> FoodItem | tuple[str, int]:
     }
 
     # Check circuit breaker status
-    cb: CircuitBreaker | None = get_latest_cb(event_name=EXTERNAL_API_EVENT_NAME)
-    cb_state: CircuitBreakerState = get_cb_state(cb)
-    if cb_state == CircuitBreakerState.OPEN:
+    if not EXTERNAL_API_CIRCUIT_BREAKER.allow_request():
         return "Error: circuit breaker is tripped", 503
 
     # Try to get response from external API
-    response_internal: FoodItem | tuple[str, int] | None = None
-    response_error: tuple[str, int] | None = None
-    for retry in range(EXTERNAL_API_RETRY):
+    policy: RetryPolicy = EXTERNAL_API_RETRY_POLICY
+    deadline_at: float = policy.start()
+    response_internal: dict[str, Any] | tuple[str, int] | None = None
+    response_error: tuple[str, int] = "Error: deadline for reaching Calorie Ninjas API exceeded", 504
+    for attempt in range(policy.attempts):
         try:
-            response_external: Response = requests.get(url, params=params, headers=headers)
+            response_external: Response = HTTP_CLIENT.get(url, "calorie_ninjas", params=params, headers=headers, timeout=policy.timeouts(deadline_at))
             if response_external.ok:
                 try:
-                    content: dict[str, Any] = json.loads(response_external.content.decode(RESPONSE_ENCODING))
+                    response_internal = json.loads(response_external.content.decode(RESPONSE_ENCODING))
                 except Exception as e:
                     response_internal = f"Failed to convert response to JSON: {str(e)}", 500
-                    break
-                if len(content["items"]) < 1:
-                    response_internal = response_external.text, 404
-                    break
-                try:
-                    food_item: FoodItem = FoodItemConverter.to_entity(content["items"][0])
-                    if not check_existing_records(food_item.name):
-                        food_item.save()
-                    response_internal = food_item
-                    break
-                except KeyError as e:
-                    response_internal = f"Error: Failed to convert food item from API response: {str(e)}", 500
-                    break
-            else:
-                response_error = response_external.text, response_external.status_code
+                break
+            response_error = response_external.text, response_external.status_code
+            if not policy.is_retryable(response_external.status_code):
+                break
         except Exception as e:
             response_error = str(e), 500
-        time.sleep(EXTERNAL_API_DELAY)
-
-    if response_internal is None:
-        # Failed to get valid response from API
-        if cb_state == CircuitBreakerState.CLOSED or cb is None:
-            trip_cb(EXTERNAL_API_EVENT_NAME)
-        elif cb_state == CircuitBreakerState.HALF_OPEN:
-            update_half_open_cb(cb, success=False)
-        return cast(tuple[str, int], response_error)
-    else:
-        # Response was successful
-        if cb_state == CircuitBreakerState.HALF_OPEN and cb is not None:
-            update_half_open_cb(cb, success=True)
-        return response_internal
+        if not policy.wait(attempt, deadline_at):
+            break
+
+    # Update circuit breaker according to whether we got a valid response from API
+    EXTERNAL_API_CIRCUIT_BREAKER.record(success=response_internal is not None)
+    return response_error if response_internal is None else response_internal
+
+def chunk_queries(names: list[str]) -> list[list[str]]:
+    # Pack names into as few upstream queries as the API's query length limit allows
+    chunks: list[list[str]] = []
+    chunk: list[str] = []
+    chunk_length: int = 0
+    for name in names:
+        added_length: int = len(name) + (len(EXTERNAL_API_QUERY_SEPARATOR) if chunk else 0)
+        if chunk and (chunk_length + added_length > EXTERNAL_API_MAX_QUERY_LENGTH or len(chunk) >= EXTERNAL_API_MAX_QUERY_ITEMS):
+            chunks.append(chunk)
+            chunk, chunk_length = [], 0
+            added_length = len(name)
+        chunk.append(name)
+        chunk_length += added_length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def get_nutrition_facts_batch(queries: list[str]) -> dict[str, FoodItem | tuple[str, int]]:
+    # Results are keyed by normalized query
+    results: dict[str, FoodItem | tuple[str, int]] = {}
+    names: list[str] = list(dict.fromkeys(normalize_query(query) for query in queries))
+
+    # Serve cached names from memory
+    missing: list[str] = []
+    for name in names:
+        if not name:
+            results[name] = "Food name cannot be empty", 400
+            continue
+        cached_item: FoodItem | None = FOOD_ITEM_CACHE.get(name)
+        if cached_item is not None:
+            results[name] = cached_item
+        elif UNKNOWN_FOOD_CACHE.get(name):
+            results[name] = UNKNOWN_FOOD_RESPONSE, 404
+        else:
+            missing.append(name)
+
+    # Resolve stored names with a single query
+    if missing:
+        for food_item in FoodItem.objects(name__in=missing):
+            results[food_item.name] = food_item
+            FOOD_ITEM_CACHE.set(food_item.name, food_item)
+            FOOD_NAME_INDEX.add(food_item.name)
+        missing = [name for name in missing if name not in results]
+    if missing:
+        for name in check_unknown_records(missing):
+            results[name] = UNKNOWN_FOOD_RESPONSE, 404
+        missing = [name for name in missing if name not in results]
+
+    # Fetch the remaining names from external API, several foods per request
+    new_items: dict[str, FoodItem] = {}
+    unknown: list[str] = []
+    for chunk in chunk_queries(missing):
+        content: dict[str, Any] | tuple[str, int] = request_calorie_ninjas(EXTERNAL_API_QUERY_SEPARATOR.join(chunk))
+        if isinstance(content, tuple):
+            for name in chunk:
+                results[name] = content
+            continue
+        # The API may split one query into several items or drop one, so items are matched by name, never by position
+        by_name: dict[str, FoodItem] = {}
+        failed: int = 0
+        for item in content["items"]:
+            try:
+                food_item: FoodItem = FoodItemConverter.to_entity(item)
+            except KeyError:
+                failed += 1
+                continue
+            by_name.setdefault(normalize_query(food_item.name), food_item)
+        for name in chunk:
+            matched: FoodItem | None = by_name.get(name)
+            if matched is None and failed:
+                # The unmatched item might be one that could not be converted
+                results[name] = "Error: Failed to convert food item from API response", 500
+                continue
+            if matched is None:
+                results[name] = UNKNOWN_FOOD_RESPONSE, 404
+                # Unmatched names are only certainly unknown if the API found nothing at all
+                if not content["items"]:
+                    unknown.append(name)
+                continue
+            new_items.setdefault(matched.name, matched)
+            results[name] = new_items[matched.name]
+
+    remember_unknown(unknown)
+
+    # Bulk insert new food items
+    if new_items:
+        documents: list[dict[str, Any]] = [food_item.to_mongo().to_dict() for food_item in new_items.values()]
+        try:
+            inserted: InsertManyResult = FoodItem._get_collection().insert_many(documents, ordered=False)
+            for food_item, inserted_id in zip(new_items.values(), inserted.inserted_ids):
+                food_item.id = inserted_id
+        except BulkWriteError:
+            # Some of the foods were inserted concurrently, reload all of them
+            for food_item in FoodItem.objects(name__in=list(new_items.keys())):
+                new_items[food_item.name] = food_item
+            for name, result in results.items():
+                if isinstance(result, FoodItem) and result.name in new_items:
+                    results[name] = new_items[result.name]
+        for name in new_items.keys():
+            FOOD_NAME_INDEX.add(name)
+        for name, result in results.items():
+            if isinstance(result, FoodItem):
+                FOOD_ITEM_CACHE.set(name, result)
+
+    return results
 
+def batch_results_to_dict(queries: list[str], results: dict[str, FoodItem | tuple[str, int]]) -> dict[str, dict[str, Any]]:
+    # Result of each query (as sent, not normalized), as returned by the batch endpoint
+    food_items: dict[str, dict[str, Any]] = {}
+    for query in queries:
+        result: FoodItem | tuple[str, int] = results[normalize_query(query)]
+        if isinstance(result, FoodItem):
+            food_items[query] = {"food_item": FoodItemConverter.to_dict(result), "status": 200}
+        else:
+            food_items[query] = {"error": result[0], "status": result[1]}
+    return food_items
@@ -0,0 +1,45 @@
+from typing import Callable, Iterable
+import bisect
+import threading
+
+class PrefixIndex():
+    # Sorted list of unique names, so a prefix lookup is a binary search plus a short scan
+    def __init__(self, loader: Callable[[], Iterable[str]]):
+        self._loader: Callable[[], Iterable[str]] = loader
+        self._names: list[str] = []
+        self._loaded: bool = False
+        self._lock: threading.Lock = threading.Lock()
+
+    def load(self):
+        names: list[str] = sorted(set(self._loader()))
+        with self._lock:
+            # Keep names that were added while loading
+            self._names = sorted(set(names).union(self._names))
+            self._loaded = True
+
+    def add(self, name: str):
+        with self._lock:
+            index: int = bisect.bisect_left(self._names, name)
+            if index == len(self._names) or self._names[index] != name:
+                self._names.insert(index, name)
+
+    def search(self, prefix: str, limit: int) -> list[str]:
+        if not self._loaded:
+            self.load()
+        names: list[str] = self._names
+        start: int = bisect.bisect_left(names, prefix)
+        matches: list[str] = []
+        for name in names[start:start + limit]:
+            if not name.startswith(prefix):
+                break
+            matches.append(name)
+        return matches
+
+    def clear(self):
+        # Forget all names; the index is reloaded on next search
+        with self._lock:
+            self._names = []
+            self._loaded = False
+
+    def __len__(self) -> int:
+        return len(self._names)
@@ -2,6 +2,18 @@ from typing import Any
 from food_item.src.models.entities.food_item import FoodItem
 
 WEIGHT_DEFAULT: float = 100.0
+NUTRIENT_FIELDS: list[str] = [
+    "calories",
+    "fat_total",
+    "fat_saturated",
+    "protein",
+    "carbohydrates",
+    "fiber",
+    "sugar",
+    "sodium",
+    "potassium",
+    "cholesterol",
+]
 
 def get_multiple_keys(dictionary: dict[Any, Any], keys: list[Any]) -> Any:
     for key in keys:
@@ -10,4 +10,9 @@ class CircuitBreaker(me.Document):
     state: CircuitBreakerState = me.EnumField(CircuitBreakerState, required=True)
     event_name: str = me.StringField(required=True)
     timestamp: float = me.FloatField(required=True)
-
+    meta = {
+        "indexes": [
+            # Latest state of a circuit breaker, and compaction of its old transitions
+            ("event_name", "-timestamp"),
+        ],
+    }
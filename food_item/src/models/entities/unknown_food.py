@@ -0,0 +1,12 @@
+import datetime
+import mongoengine as me
+
+class UnknownFood(me.Document):
+    name: str = me.StringField(required=True, unique=True)
+    expires_at: datetime.datetime = me.DateTimeField(required=True)
+    meta = {
+        "indexes": [
+            # MongoDB removes each document once its expires_at has passed
+            {"fields": ["expires_at"], "expireAfterSeconds": 0},
+        ],
+    }
@@ -1,11 +1,26 @@
+from typing import Any
 from flask.testing import FlaskClient
 from food_item.src.api.v1.api import app
+from food_item.src.cli.import_catalog import import_catalog
+from food_item.src.core import manage_food_item
+from food_item.src.core.fault_tolerance import LocalCircuitBreaker, RetryPolicy
+from food_item.src.core.manage_food_item import FOOD_ITEM_CACHE, FOOD_NAME_INDEX, UNKNOWN_FOOD_CACHE
+from food_item.src.models.entities.food_item import FoodItem
+from food_item.src.models.entities.circuit_breaker import CircuitBreaker, CircuitBreakerState
+from food_item.src.models.entities.unknown_food import UnknownFood
+from shared.src.core.http_client import HTTP_CLIENT
+from shared.test.query_plan import assert_no_collscan
 import pytest
 from pymongo.synchronous.database import Database
 from pymongo.synchronous.mongo_client import MongoClient
 from mongoengine import disconnect_all, connect
 from dotenv import load_dotenv
+import datetime
+import io
+import time
 import os
+import requests
+from unittest import mock
 
 app.config["TESTING"] = True
 load_dotenv()
@@ -27,6 +42,10 @@ def database():
     # Clear test DB
     for collection in db.list_collection_names():
         db.drop_collection(collection)
+    # Clear in-process caches (they may hold documents from the dropped DB)
+    FOOD_ITEM_CACHE.clear()
+    UNKNOWN_FOOD_CACHE.clear()
+    FOOD_NAME_INDEX.clear()
     # Run test
     yield db
     # Disconnect from DB
@@ -74,3 +93,251 @@ def test_query_invalid(client: FlaskClient, database: Database):
     assert resp.json["error"]
     assert resp.status_code == 404
 
+
+def test_query_cached(client: FlaskClient, database: Database):
+    # Prepare request
+    query: str = "apple"
+    # First lookup populates the cache
+    resp = client.get(f"/api/v1/food_item/{query}")
+    assert resp.json is not None
+    assert resp.status_code == 200
+    food_item_id: str = resp.json["food_item"]["id"]
+    # Repeated lookups (with different casing) must not touch the database
+    with mock.patch.object(FoodItem, "objects") as mock_objects:
+        resp = client.get(f"/api/v1/food_item/{query.upper()}")
+        assert resp.json is not None
+        assert resp.status_code == 200
+        assert resp.json["food_item"]["id"] == food_item_id
+        mock_objects.assert_not_called()
+
+def test_query_batch(client: FlaskClient, database: Database):
+    # Prepare request (one repeated food, one invalid food)
+    queries: list[str] = ["apple", "banana", "Apple", "this_is_not_a_valid_food_name"]
+    # Get response from API
+    resp = client.post("/api/v1/food_item/batch", json={"queries": queries})
+    assert resp.json is not None
+    assert resp.status_code == 200
+    results = resp.json["food_items"]
+    # Check that every query has its own result
+    assert set(results.keys()) == set(queries)
+    for query in ["apple", "banana", "Apple"]:
+        assert results[query]["status"] == 200
+        assert results[query]["food_item"]["name"] == query.lower()
+        assert results[query]["food_item"]["id"]
+    assert results["apple"]["food_item"]["id"] == results["Apple"]["food_item"]["id"]
+    assert results["this_is_not_a_valid_food_name"]["status"] == 404
+    assert results["this_is_not_a_valid_food_name"]["error"]
+    # Found foods are stored, so single lookups return the same documents
+    resp = client.get("/api/v1/food_item/banana")
+    assert resp.json is not None
+    assert resp.json["food_item"]["id"] == results["banana"]["food_item"]["id"]
+
+def api_item(name: str, calories: float) -> dict[str, Any]:
+    # Item in the format returned by Calorie Ninjas
+    item: dict[str, Any] = {"name": name, "calories": calories, "serving_size_g": 100.0}
+    for key in ["fat_total_g", "fat_saturated_g", "protein_g", "sodium_mg", "potassium_mg", "cholesterol_mg", "carbohydrates_total_g", "fiber_g", "sugar_g"]:
+        item[key] = 1.0
+    return item
+
+def test_query_batch_matched_by_name(client: FlaskClient, database: Database):
+    # As many items as queries, but one query was split in two, another dropped and the order changed
+    content: dict[str, Any] = {"items": [api_item("banana", 89), api_item("peanut", 567), api_item("butter", 717)]}
+    with mock.patch.object(manage_food_item, "request_calorie_ninjas", return_value=content):
+        resp = client.post("/api/v1/food_item/batch", json={"queries": ["peanut butter", "apple", "Banana"]})
+    assert resp.json is not None
+    results = resp.json["food_items"]
+    assert results["Banana"]["status"] == 200
+    assert results["Banana"]["food_item"]["name"] == "banana"
+    assert results["Banana"]["food_item"]["calories"] == 89
+    assert results["peanut butter"]["status"] == 404
+    assert results["apple"]["status"] == 404
+    # Nothing was stored or cached under the wrong name
+    assert FoodItem.objects(name="apple").count() == 0
+    assert FOOD_ITEM_CACHE.get("apple") is None
+    assert FOOD_ITEM_CACHE.get("peanut butter") is None
+
+def test_query_invalid_remembered(client: FlaskClient, database: Database):
+    # Prepare request
+    query: str = "this_is_not_a_valid_food_name"
+    # First lookup asks the external API
+    resp = client.get(f"/api/v1/food_item/{query}")
+    assert resp.status_code == 404
+    # Repeated lookups are answered locally, also after the in-process cache is gone (e.g. restart)
+    for clear_local_cache in [False, True]:
+        if clear_local_cache:
+            UNKNOWN_FOOD_CACHE.clear()
+        with mock.patch.object(HTTP_CLIENT, "get") as mock_get:
+            resp = client.get(f"/api/v1/food_item/{query}")
+            assert resp.json is not None
+            assert resp.json["error"]
+            assert resp.status_code == 404
+            mock_get.assert_not_called()
+
+def test_search(client: FlaskClient, database: Database):
+    # Add food items
+    for query in ["apple", "banana"]:
+        resp = client.get(f"/api/v1/food_item/{query}")
+        assert resp.status_code == 200
+    # Search by prefix
+    resp = client.get("/api/v1/food_item/search?prefix=App")
+    assert resp.json is not None
+    assert resp.status_code == 200
+    assert "apple" in resp.json["names"]
+    assert "banana" not in resp.json["names"]
+    # Searching must not hit the database
+    with mock.patch.object(FoodItem, "_get_collection") as mock_collection:
+        resp = client.get("/api/v1/food_item/search?prefix=ban&limit=1")
+        assert resp.json is not None
+        assert resp.json["names"] == ["banana"]
+        mock_collection.assert_not_called()
+
+def make_retry_policy(jitter: float = 0.0, deadline: float = 100.0) -> RetryPolicy:
+    return RetryPolicy(attempts=5, base_delay=0.5, max_delay=3.0, jitter=jitter, deadline=deadline, connect_timeout=2.0, read_timeout=5.0)
+
+def test_retry_policy_backoff():
+    # Doubles on every retry, up to the max delay
+    assert [make_retry_policy().backoff(attempt) for attempt in range(5)] == [0.5, 1.0, 2.0, 3.0, 3.0]
+    # Jitter randomizes only the given fraction of each backoff
+    policy: RetryPolicy = make_retry_policy(jitter=0.5)
+    for attempt in range(5):
+        delay: float = min(3.0, 0.5 * 2 ** attempt)
+        assert delay * 0.5 <= policy.backoff(attempt) <= delay
+
+def test_retry_policy_wait():
+    policy: RetryPolicy = make_retry_policy(deadline=1.0)
+    with mock.patch("gevent.sleep") as mock_sleep:
+        deadline_at: float = policy.start()
+        assert policy.wait(0, deadline_at)
+        mock_sleep.assert_called_once_with(0.5)
+        # Backoff would end after the deadline
+        assert not policy.wait(1, deadline_at)
+        # No sleep after the last attempt
+        assert not policy.wait(4, policy.start() + 100)
+        assert mock_sleep.call_count == 1
+    # Per-attempt timeouts never exceed what is left of the deadline
+    assert policy.timeouts(time.monotonic() + 0.1)[1] <= 0.1
+
+def test_request_retries():
+    def api_response(status_code: int) -> mock.MagicMock:
+        return mock.MagicMock(ok=status_code < 400, status_code=status_code, text="error", content=b'{"items": []}')
+
+    cases: list[tuple[list[Any], int, int]] = [
+        # Retryable responses and errors are attempted as often as allowed, sleeping only between attempts
+        ([api_response(503)] * 3, 503, 2),
+        ([requests.exceptions.ConnectionError("refused")] * 3, 500, 2),
+        # Success after a retry
+        ([api_response(502), api_response(200)], 200, 1),
+        # Non-retryable responses are not repeated
+        ([api_response(400)], 400, 0),
+    ]
+    for side_effect, status_code, sleeps in cases:
+        with mock.patch.object(manage_food_item.EXTERNAL_API_CIRCUIT_BREAKER, "allow_request", return_value=True), \
+                mock.patch.object(manage_food_item.EXTERNAL_API_CIRCUIT_BREAKER, "record") as mock_record, \
+                mock.patch.object(HTTP_CLIENT, "get", side_effect=side_effect) as mock_get, \
+                mock.patch("gevent.sleep") as mock_sleep:
+            result: dict[str, Any] | tuple[str, int] = manage_food_item.request_calorie_ninjas("apple")
+            assert mock_get.call_count == len(side_effect)
+            assert mock_sleep.call_count == sleeps
+            assert (200 if isinstance(result, dict) else result[1]) == status_code
+            mock_record.assert_called_once_with(success=status_code == 200)
+
+def make_circuit_breaker(persisted: list[CircuitBreakerState]) -> LocalCircuitBreaker:
+    breaker: LocalCircuitBreaker = LocalCircuitBreaker(
+        event_name="test",
+        failure_rate_threshold=0.5,
+        minimum_calls=4,
+        window_size=10,
+        open_timeout=0.05,
+        half_open_max_probes=2,
+        sync_interval=float("inf"),
+        retention=3600,
+    )
+
+    def persist(state: CircuitBreakerState, since: float):
+        # Transitions are written without holding the lock that requests wait for
+        assert not breaker._lock.locked()
+        persisted.append(state)
+
+    breaker._persist = persist
+    return breaker
+
+def test_circuit_breaker_state_machine():
+    persisted: list[CircuitBreakerState] = []
+    breaker: LocalCircuitBreaker = make_circuit_breaker(persisted)
+    # Stays closed until enough calls were made, then opens at the failure rate threshold
+    for success in [False, True, True, True, False]:
+        assert breaker.allow_request()
+        breaker.record(success)
+        assert breaker.state == CircuitBreakerState.CLOSED
+    breaker.record(False)
+    assert breaker.state == CircuitBreakerState.OPEN
+    assert not breaker.allow_request()
+    # After the open timeout, only a limited number of probes is let through
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreakerState.HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    # Enough successful probes close the breaker
+    breaker.record(True)
+    assert breaker.state == CircuitBreakerState.HALF_OPEN
+    breaker.record(True)
+    assert breaker.state == CircuitBreakerState.CLOSED
+    assert breaker.allow_request()
+    assert persisted == [CircuitBreakerState.OPEN, CircuitBreakerState.HALF_OPEN, CircuitBreakerState.CLOSED]
+
+def test_circuit_breaker_failed_probe():
+    persisted: list[CircuitBreakerState] = []
+    breaker: LocalCircuitBreaker = make_circuit_breaker(persisted)
+    for _ in range(4):
+        breaker.record(False)
+    assert breaker.state == CircuitBreakerState.OPEN
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    # A failed probe opens the breaker again, for another open timeout
+    breaker.record(False)
+    assert breaker.state == CircuitBreakerState.OPEN
+    assert not breaker.allow_request()
+    assert persisted == [CircuitBreakerState.OPEN, CircuitBreakerState.HALF_OPEN, CircuitBreakerState.OPEN]
+
+def test_import_catalog_skips_bad_rows(database: Database):
+    # Names that look like numbers stay names, rows with non-numeric nutrients are skipped
+    header: str = "name,serving_size_g,calories,fat_total_g,fat_saturated_g,protein_g,carbohydrates_total_g,fiber_g,sugar_g,sodium_mg,potassium_mg,cholesterol_mg\n"
+    csv_stats: dict[str, int] = import_catalog(io.StringIO(
+        header
+        + "100,100,50,1,0,2,10,1,5,1,100,0\n"
+        + "nan,200,100,2,0,4,20,2,10,2,200,0\n"
+        + "apple,100,inf,0,0,0,14,2,10,1,107,0\n"
+        + "pear,100,abc,0,0,0,15,3,10,1,116,0\n"
+    ), "csv", batch_size=10)
+    assert csv_stats["read"] == 4
+    assert csv_stats["upserted"] == 2
+    assert csv_stats["skipped"] == 2
+    assert FoodItem.objects(name="100").get().calories == 50
+    assert FoodItem.objects(name="nan").get().calories == 50
+    # A malformed JSONL line (or a numeric name) is skipped instead of aborting the import
+    jsonl_stats: dict[str, int] = import_catalog(io.StringIO(
+        '{"name": "banana", "weight_g": 100, "calories": 89, "fat_total": 0.3, "fat_saturated": 0.1, "protein": 1.1, "carbohydrates": 23, "fiber": 2.6, "sugar": 12, "sodium": 1, "potassium": 358, "cholesterol": 0}\n'
+        + '{"name": "broken", "weight_g": 100,\n'
+        + '{"name": 7, "weight_g": 100, "calories": 1, "fat_total": 0, "fat_saturated": 0, "protein": 0, "carbohydrates": 0, "fiber": 0, "sugar": 0, "sodium": 0, "potassium": 0, "cholesterol": 0}\n'
+        + '[1, 2]\n'
+    ), "jsonl", batch_size=10)
+    assert jsonl_stats["read"] == 4
+    assert jsonl_stats["upserted"] == 1
+    assert jsonl_stats["skipped"] == 3
+    assert FoodItem.objects(name="banana").count() == 1
+
+def test_indexes_used(database: Database):
+    for document in [FoodItem, CircuitBreaker, UnknownFood]:
+        document.ensure_indexes()
+    FoodItem(name="apple", calories=52.0, weight_g=100.0).save()
+    CircuitBreaker(state=CircuitBreakerState.OPEN, event_name="test", timestamp=1.0).save()
+    UnknownFood(name="xyz", expires_at=datetime.datetime.now(datetime.timezone.utc)).save()
+    # Food item lookups by name
+    assert_no_collscan(FoodItem.objects(name="apple").explain())
+    assert_no_collscan(FoodItem.objects(name__in=["apple", "banana"]).explain())
+    # Latest circuit breaker state, and compaction of old transitions
+    assert_no_collscan(CircuitBreaker.objects(event_name="test").order_by("-timestamp").explain())
+    assert_no_collscan(CircuitBreaker.objects(event_name="test", timestamp__lt=2.0).explain())
+    # Negative cache lookups
+    assert_no_collscan(UnknownFood.objects(name__in=["xyz"], expires_at__gt=datetime.datetime.now(datetime.timezone.utc)).explain())
@@ -1,14 +1,18 @@
+from shared.src.core.runtime import is_production, patch_for_production
+patch_for_production()
 import os
-from flask import Response, jsonify, request
+from flask import Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from gevent.pywsgi import WSGIServer
 from mongoengine import connect, get_connection
 from dotenv import load_dotenv
-from typing import Any, cast
-from logged_item.src.core.manage_logged_item import add_item_to_user, delete_logged_item, delete_logged_items_for_user, get_logged_item, get_logged_items
+from typing import Any, Iterator, cast
+from logged_item.src.core.manage_logged_item import add_item_to_user, add_items_to_user, delete_logged_item, delete_logged_items_for_user, get_logged_item, get_logged_item_totals, get_logged_items_page, get_remaining_nutrients, stream_logged_items
 from logged_item.src.models.converters.logged_item_converter import LoggedItemConverter
 from logged_item.src.models.entities.logged_item import LoggedItem
+from logged_item.src.models.entities.daily_rollup import DailyRollup
 import datetime
+import json
 import time
 from flask_openapi3.openapi import OpenAPI
 from flask_openapi3.models.info import Info
@@ -16,8 +20,12 @@ from flask_openapi3.models.tag import Tag
 from pydantic import BaseModel, Field
 from prometheus_client import make_wsgi_app, Counter, Histogram
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from shared.src.core.health import HealthMonitor
 
 DATE_FORMAT: str = "%d/%m/%Y"
+HISTORY_FORMATS: list[str] = ["json", "ndjson"]
+HISTORY_MAX_LIMIT: int = int(os.environ.get("LOGGED_ITEM_HISTORY_MAX_LIMIT", 1000))
+BATCH_MAX_ITEMS: int = int(os.environ.get("LOGGED_ITEM_BATCH_MAX_ITEMS", 100))
 
 load_dotenv()
 connect(
@@ -85,10 +93,45 @@ class LoggedItemWithNutrientsPydantic(BaseModel):
 
 class GetUserItemsResponse(BaseModel):
     logged_items: list[LoggedItemWithNutrientsPydantic]
+    next_cursor: str | None = Field(None, description="Cursor of the next page (null if there are no more items)")
 
 class GetUserItemsResponseError(BaseModel):
     error: str = Field("Failed to get logged items: ...", description="Error message")
 
+class NutrientTotalsPydantic(BaseModel):
+    start: str = Field("13/01/2025", description="First day of the bucket")
+    item_count: int = Field(3, description="Number of logged items in the bucket")
+    weight_g: float = Field(450.0, description="Total weight of logged items in grams")
+    calories: float = Field(1130.5, description="Number of calories")
+    fat_total: float = Field(50.2, description="Total amout of fats in grams")
+    fat_saturated: float = Field(20.1, description="Total amout of saturated saturated fats in grams")
+    carbohydrates: float = Field(120.4, description="Total amout of carbohydrates in grams")
+    fiber: float = Field(12.6, description="Total amout of fiber in grams")
+    sugar: float = Field(30.3, description="Total amout of sugar in grams")
+    protein: float = Field(60.7, description="Total amout of protein in grams")
+    cholesterol: float = Field(150.0, description="Total amout of cholesterol in milligrams")
+    potassium: float = Field(1800.0, description="Total amout of potassium in milligrams")
+    sodium: float = Field(1500.0, description="Total amout of sodium in milligrams")
+
+class GetUserTotalsResponse(BaseModel):
+    bucket: str = Field("day", description="Size of buckets (day, week or month)")
+    totals: list[NutrientTotalsPydantic]
+
+class GetUserTotalsResponseError(BaseModel):
+    error: str = Field("Failed to get totals: ...", description="Error message")
+
+class RemainingNutrientPydantic(BaseModel):
+    consumed: float = Field(1130.5, description="Amount consumed on the day")
+    target: float = Field(2555.6, description="Daily RDA")
+    remaining: float = Field(1425.1, description="Amount left until the daily RDA is reached (negative if exceeded)")
+
+class GetUserRemainingResponse(BaseModel):
+    date: str = Field("13/01/2025", description="Day of the amounts")
+    nutrients: dict[str, RemainingNutrientPydantic] = Field(..., description="Amounts per nutrient (calories, fat_total, ...)")
+
+class GetUserRemainingResponseError(BaseModel):
+    error: str = Field("Failed to get remaining nutrients: ...", description="Error message")
+
 class AddItemToUserResponse(BaseModel):
     message: str = Field("Successfully logged new item", description="Success message")
     logged_item: LoggedItemWithNutrientsPydantic
@@ -96,6 +139,18 @@ class AddItemToUserResponse(BaseModel):
 class AddItemToUserResponseError(BaseModel):
     error: str = Field("Failed to log item: ...", description="Error message")
 
+class AddItemsResultPydantic(BaseModel):
+    status: int = Field(200, description="Status code of this entry")
+    logged_item: LoggedItemPydantic | None = Field(None, description="Logged item (if status is 200)")
+    error: str | None = Field(None, description="Error message (if status is not 200)")
+
+class AddItemsToUserResponse(BaseModel):
+    message: str = Field("Logged 8 of 8 items", description="Success message")
+    results: list[AddItemsResultPydantic] = Field(..., description="Result of each entry, in order of the request")
+
+class AddItemsToUserResponseError(BaseModel):
+    error: str = Field("Failed to log items: ...", description="Error message")
+
 class DeleteItemsFromUser(BaseModel):
     message: str = Field("Successfully deleted logged items for user with id ...", description="Success message")
 
@@ -108,10 +163,20 @@ class ManageItemPath(BaseModel):
 class ManageUserPath(BaseModel):
     user_id: str = Field(..., description="Id of user")
 
+class UserItemsQuery(BaseModel):
+    from_: str | None = Field(None, alias="from", description="First day (dd/mm/yyyy), default is 01/01/1970")
+    to: str | None = Field(None, description="Last day (dd/mm/yyyy), default is today")
+    limit: int | None = Field(None, ge=1, description="Max number of returned items (all items by default)")
+    cursor: str | None = Field(None, description="Return items after this cursor (next_cursor of previous page)")
+    format: str = Field("json", description="json: one JSON document, ndjson: stream items as newline delimited JSON (ignores limit)")
+
 class LoggedItemBody(BaseModel):
     food_name: str = Field("Apple", description="Name of the food")
     weight: float = Field(100.0, description="Weight in grams")
 
+class LoggedItemsBody(BaseModel):
+    items: list[LoggedItemBody] = Field(..., description="Items to log (e.g. ingredients of a meal)")
+
 REQ_COUNT: Counter = Counter(
     "logged_item_req_count",
     "Microservice logged_item Request Count",
@@ -123,6 +188,14 @@ REQ_LATENCY: Histogram = Histogram(
     ["method", "endpoint"],
 )
 
+HEALTH_MONITOR: HealthMonitor = HealthMonitor(
+    service="logged_item",
+    interval=float(os.environ.get("HEALTH_CHECK_INTERVAL", 10)),
+    max_staleness=float(os.environ.get("HEALTH_CHECK_MAX_STALENESS", 30)),
+    timeout=float(os.environ.get("HEALTH_CHECK_TIMEOUT", 5)),
+)
+HEALTH_MONITOR.add_check("database", lambda: get_connection().server_info(), 503, "Database not available: ")
+
 @app.get(
     "/api/v1/",
     responses={
@@ -178,32 +251,108 @@ def delete_item(path: ManageItemPath):
 @app.get(
     "/api/v1/logged_item/user/<string:user_id>",
     tags=[TAG_USER],
-    summary="Get all of user's logged items",
+    summary="Get user's logged items, optionally paginated or streamed",
     responses={
         200: GetUserItemsResponse,
         400: GetUserItemsResponseError,
     },
 )
-def get_user_logged_items(path: ManageUserPath):
+def get_user_logged_items(path: ManageUserPath, query: UserItemsQuery):
     time_start: float = time.time()
-    from_date: datetime.date = datetime.date.fromtimestamp(0)
-    to_date: datetime.date = datetime.date.fromtimestamp(time.time())
-    from_str: str | None = request.args.get("from")
-    to_str: str | None = request.args.get("to")
-    if from_str:
-        from_date = datetime.datetime.strptime(from_str, DATE_FORMAT).date()
-    if to_str:
-        to_date = datetime.datetime.strptime(to_str, DATE_FORMAT).date()
     response: tuple[Response, int] = jsonify({}), 0
     try:
-        logged_items: list[dict[str, Any]] = get_logged_items(path.user_id, from_date, to_date)
-        response = jsonify({"logged_items": logged_items}), 200
+        from_date: datetime.date = datetime.date.fromtimestamp(0)
+        to_date: datetime.date = datetime.date.fromtimestamp(time.time())
+        if query.from_:
+            from_date = datetime.datetime.strptime(query.from_, DATE_FORMAT).date()
+        if query.to:
+            to_date = datetime.datetime.strptime(query.to, DATE_FORMAT).date()
+        if query.format not in HISTORY_FORMATS:
+            raise Exception(f"Invalid format: {query.format}, allowed values: {HISTORY_FORMATS}")
+        if query.format == "ndjson":
+            logged_items: Iterator[dict[str, Any]] = stream_logged_items(path.user_id, from_date, to_date, query.cursor)
+            REQ_COUNT.labels("GET", "/api/v1/logged_item/user/<string:user_id>", 200).inc()
+            return Response(stream_with_context(stream_items(logged_items, time_start)), status=200, mimetype="application/x-ndjson")
+        if query.limit is not None and query.limit > HISTORY_MAX_LIMIT:
+            raise Exception(f"Limit must not exceed {HISTORY_MAX_LIMIT}")
+        page, next_cursor = get_logged_items_page(path.user_id, from_date, to_date, query.cursor, query.limit)
+        response = jsonify({"logged_items": page, "next_cursor": next_cursor}), 200
     except Exception as e:
         response = jsonify({"error": f"Failed to get logged items: {str(e)}"}), 400
     REQ_COUNT.labels("GET", "/api/v1/logged_item/user/<string:user_id>", response[1]).inc()
     REQ_LATENCY.labels("GET", "/api/v1/logged_item/user/<string:user_id>").observe(time.time() - time_start)
     return response
 
+def stream_items(logged_items: Iterator[dict[str, Any]], time_start: float) -> Iterator[str]:
+    # Status is already sent, so a failure while streaming ends the response with an error line
+    try:
+        for logged_item in logged_items:
+            yield json.dumps(logged_item) + "\n"
+    except Exception as e:
+        yield json.dumps({"error": f"Failed to get logged items: {str(e)}"}) + "\n"
+    finally:
+        REQ_LATENCY.labels("GET", "/api/v1/logged_item/user/<string:user_id>").observe(time.time() - time_start)
+
+@app.get(
+    "/api/v1/logged_item/user/<string:user_id>/totals",
+    tags=[TAG_USER],
+    summary="Get sums of user's nutrient intake per day, week or month",
+    responses={
+        200: GetUserTotalsResponse,
+        400: GetUserTotalsResponseError,
+    },
+)
+def get_user_totals(path: ManageUserPath):
+    time_start: float = time.time()
+    response: tuple[Response, int] = jsonify({}), 0
+    try:
+        from_date: datetime.date = datetime.date.fromtimestamp(0)
+        to_date: datetime.date = datetime.date.fromtimestamp(time.time())
+        from_str: str | None = request.args.get("from")
+        to_str: str | None = request.args.get("to")
+        bucket: str = request.args.get("bucket", "day")
+        if from_str:
+            from_date = datetime.datetime.strptime(from_str, DATE_FORMAT).date()
+        if to_str:
+            to_date = datetime.datetime.strptime(to_str, DATE_FORMAT).date()
+        totals: list[dict[str, Any]] = get_logged_item_totals(path.user_id, from_date, to_date, bucket)
+        for total in totals:
+            total["start"] = total["start"].strftime(DATE_FORMAT)
+        response = jsonify({"bucket": bucket, "totals": totals}), 200
+    except Exception as e:
+        response = jsonify({"error": f"Failed to get totals: {str(e)}"}), 400
+    REQ_COUNT.labels("GET", "/api/v1/logged_item/user/<string:user_id>/totals", response[1]).inc()
+    REQ_LATENCY.labels("GET", "/api/v1/logged_item/user/<string:user_id>/totals").observe(time.time() - time_start)
+    return response
+
+@app.get(
+    "/api/v1/logged_item/user/<string:user_id>/remaining",
+    tags=[TAG_USER],
+    summary="Get user's consumed, target (daily RDA) and remaining amount of each nutrient on a day (today by default)",
+    responses={
+        200: GetUserRemainingResponse,
+        400: GetUserRemainingResponseError,
+    },
+)
+def get_user_remaining(path: ManageUserPath):
+    time_start: float = time.time()
+    response: tuple[Response, int] = jsonify({}), 0
+    try:
+        date_str: str | None = request.args.get("date")
+        date: datetime.date = datetime.date.today()
+        if date_str:
+            date = datetime.datetime.strptime(date_str, DATE_FORMAT).date()
+        nutrients: dict[str, dict[str, float]] | tuple[str, int] = get_remaining_nutrients(path.user_id, date)
+        if isinstance(nutrients, tuple):
+            response = jsonify({"error": f"Failed to get remaining nutrients: {nutrients[0]}"}), nutrients[1]
+        else:
+            response = jsonify({"date": date.strftime(DATE_FORMAT), "nutrients": nutrients}), 200
+    except Exception as e:
+        response = jsonify({"error": f"Failed to get remaining nutrients: {str(e)}"}), 400
+    REQ_COUNT.labels("GET", "/api/v1/logged_item/user/<string:user_id>/remaining", response[1]).inc()
+    REQ_LATENCY.labels("GET", "/api/v1/logged_item/user/<string:user_id>/remaining").observe(time.time() - time_start)
+    return response
+
 @app.post(
     "/api/v1/logged_item/user/<string:user_id>",
     tags=[TAG_USER],
@@ -232,6 +381,38 @@ def add_logged_item_to_user(path: ManageUserPath, body: LoggedItemBody):
     REQ_LATENCY.labels("POST", "/api/v1/logged_item/user/<string:user_id>").observe(time.time() - time_start)
     return response
 
+@app.post(
+    "/api/v1/logged_item/user/<string:user_id>/batch",
+    tags=[TAG_USER],
+    summary="Add several items to user at once",
+    responses={
+        200: AddItemsToUserResponse,
+        400: AddItemsToUserResponseError,
+    },
+)
+def add_logged_items_to_user(path: ManageUserPath, body: LoggedItemsBody):
+    time_start: float = time.time()
+    response: tuple[Response, int] = jsonify({}), 0
+    try:
+        date_str: str | None = request.args.get("date")
+        date: datetime.date = datetime.date.today()
+        if date_str:
+            date = datetime.datetime.strptime(date_str, DATE_FORMAT).date()
+        if len(body.items) > BATCH_MAX_ITEMS:
+            response = jsonify({"error": f"Too many items: {len(body.items)} (max {BATCH_MAX_ITEMS})"}), 400
+        else:
+            results: list[dict[str, Any]] | tuple[str, int] = add_items_to_user(path.user_id, date, [item.model_dump() for item in body.items])
+            if isinstance(results, list):
+                logged: int = sum(1 for result in results if result["status"] == 200)
+                response = jsonify({"message": f"Logged {logged} of {len(results)} items", "results": results}), 200
+            else:
+                response = jsonify({"error": f"Failed to log items: {results[0]}"}), results[1]
+    except Exception as e:
+        response = jsonify({"error": f"Failed to log items: {str(e)}"}), 500
+    REQ_COUNT.labels("POST", "/api/v1/logged_item/user/<string:user_id>/batch", response[1]).inc()
+    REQ_LATENCY.labels("POST", "/api/v1/logged_item/user/<string:user_id>/batch").observe(time.time() - time_start)
+    return response
+
 @app.delete(
     "/api/v1/logged_item/user/<user_id>",
     tags=[TAG_USER],
@@ -274,19 +455,26 @@ def logged_item_liveness_probe():
     },
 )
 def logged_item_readiness_probe():
-    # Check database availability
-    try:
-        get_connection().server_info()
-    except Exception as e:
-        return jsonify({"error": f"Database not available: {str(e)}"}), 503
+    # Check database availability (result of background checks)
+    error: tuple[str, int] | None = HEALTH_MONITOR.readiness()
+    if error is not None:
+        return jsonify({"error": error[0]}), error[1]
     return jsonify({"message": "Readiness probe successful"}), 200
 
+def startup():
+    # Make sure that all collections are indexed
+    for document in [LoggedItem, DailyRollup]:
+        document.ensure_indexes()
+    # Background health checks need gevent's hub, which only runs under the patched WSGIServer
+    if is_production():
+        HEALTH_MONITOR.start()
+
 if __name__ == "__main__":
-    environment: str = os.environ.get("ENVIRONMENT", "development").lower()
+    startup()
     debug: bool = (os.environ.get("FLASK_DEBUG", "True").lower() != "false")
     host: str = os.environ.get("FLASK_HOST", "0.0.0.0")
     port: int = int(os.environ.get("FLASK_PORT", 5000))
-    if environment in ["prod", "production"]:
+    if is_production():
         http_server = WSGIServer((host, port), app)
         http_server.serve_forever()
     else:
@@ -0,0 +1,75 @@
+from typing import Any
+from mongoengine import connect
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from food_item.src.models.entities.food_item import FoodItem
+from logged_item.src.core.daily_rollup import scaled_nutrients
+from logged_item.src.core.manage_logged_item import logged_items_to_food_items
+from logged_item.src.models.entities.logged_item import LoggedItem
+import argparse
+import os
+import sys
+import time
+
+BATCH_SIZE_DEFAULT: int = 1000
+
+def backfill_batch(logged_items: list[LoggedItem], stats: dict[str, int]) -> list[UpdateOne]:
+    # Food items of the whole batch are fetched with a single query
+    food_items: dict[str, FoodItem] = logged_items_to_food_items(logged_items)
+    operations: list[UpdateOne] = []
+    for logged_item in logged_items:
+        food_item: FoodItem | None = food_items.get(logged_item.food_item_id)
+        if food_item is None:
+            stats["missing"] += 1
+            print(f"Skipping logged item {str(logged_item.pk)}: food item {logged_item.food_item_id} not found", file=sys.stderr)
+            continue
+        operations.append(UpdateOne(
+            {"_id": logged_item.pk},
+            {"$set": {"food_name": food_item.name, "nutrients": scaled_nutrients(food_item, logged_item.quantity)}},
+        ))
+    return operations
+
+def backfill_snapshots(batch_size: int, user_id: str | None = None) -> dict[str, int]:
+    collection: Collection = LoggedItem._get_collection()
+    query: dict[str, Any] = {"nutrients.calories": {"$exists": False}}
+    if user_id is not None:
+        query["user_id"] = user_id
+    stats: dict[str, int] = {"read": 0, "updated": 0, "missing": 0}
+    time_start: float = time.time()
+    # Walk items in _id order, so items that cannot be backfilled are not read again
+    last_id: Any = None
+    while True:
+        batch_query: dict[str, Any] = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        logged_items: list[LoggedItem] = list(LoggedItem.objects(__raw__=batch_query).order_by("id").limit(batch_size))
+        if not logged_items:
+            break
+        last_id = logged_items[-1].pk
+        stats["read"] += len(logged_items)
+        operations: list[UpdateOne] = backfill_batch(logged_items, stats)
+        if operations:
+            stats["updated"] += collection.bulk_write(operations, ordered=False).modified_count
+        elapsed: float = max(time.time() - time_start, 1e-9)
+        print(f"Progress: {stats['read']} items read, {stats['updated']} updated, {stats['missing']} missing food items ({stats['read'] / elapsed:.0f} items/s)", file=sys.stderr)
+    return stats
+
+def main():
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Store food name and scaled nutrients on logged items that were logged without them")
+    parser.add_argument("--user", default=None, help="Only backfill items of user with this id")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE_DEFAULT, help="Number of logged items updated at once")
+    args: argparse.Namespace = parser.parse_args()
+
+    load_dotenv()
+    connect(
+        db=os.environ["MONGO_DB_NAME"],
+        host=os.environ["MONGO_HOST"],
+        port=int(os.environ["MONGO_PORT"]),
+        username=os.environ["MONGO_USERNAME"],
+        password=os.environ["MONGO_PASSWORD"],
+        uuidRepresentation="standard",
+    )
+    stats: dict[str, int] = backfill_snapshots(args.batch_size, args.user)
+    print(f"Done: {stats['read']} items read, {stats['updated']} updated, {stats['missing']} missing food items", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+from mongoengine import connect
+from dotenv import load_dotenv
+from logged_item.src.core.daily_rollup import rebuild_rollups, verify_rollups
+from logged_item.src.models.entities.daily_rollup import DailyRollup
+import argparse
+import os
+import sys
+import time
+
+def main():
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Rebuild or verify users' daily nutrient rollups against raw logged items")
+    parser.add_argument("command", choices=["rebuild", "verify"], help="rebuild: recompute rollups from logged items (stop logged_item first), verify: report rollups that differ from logged items")
+    parser.add_argument("--user", default=None, help="Only process rollups of user with this id")
+    args: argparse.Namespace = parser.parse_args()
+
+    load_dotenv()
+    connect(
+        db=os.environ["MONGO_DB_NAME"],
+        host=os.environ["MONGO_HOST"],
+        port=int(os.environ["MONGO_PORT"]),
+        username=os.environ["MONGO_USERNAME"],
+        password=os.environ["MONGO_PASSWORD"],
+        uuidRepresentation="standard",
+    )
+    DailyRollup.ensure_indexes()
+    time_start: float = time.time()
+    if args.command == "rebuild":
+        count: int = rebuild_rollups(args.user)
+        print(f"Rebuilt {count} daily rollups in {time.time() - time_start:.1f}s", file=sys.stderr)
+    else:
+        mismatches: list[str] = verify_rollups(args.user)
+        for mismatch in mismatches:
+            print(mismatch)
+        print(f"Found {len(mismatches)} mismatching daily rollups in {time.time() - time_start:.1f}s", file=sys.stderr)
+        if mismatches:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
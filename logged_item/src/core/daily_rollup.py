@@ -0,0 +1,148 @@
+from typing import Any, Iterator
+from food_item.src.models.converters.food_item_converter import NUTRIENT_FIELDS, FoodItemConverter
+from food_item.src.models.entities.food_item import FoodItem
+from logged_item.src.models.entities.daily_rollup import DailyRollup
+from logged_item.src.models.entities.logged_item import LoggedItem
+from pymongo import ReplaceOne
+from pymongo.collection import Collection
+import datetime
+
+TOTALS_BUCKETS: list[str] = ["day", "week", "month"]
+ROLLUP_FIELDS: list[str] = ["weight_g"] + NUTRIENT_FIELDS
+REBUILD_BATCH_SIZE: int = 1000
+
+def timestamp_to_day(timestamp: float) -> datetime.date:
+    # Items are logged at noon of the server's local time, so the local date is the logged day
+    # (the UTC date would be the next or previous day for offsets beyond +-12h, e.g. UTC+13)
+    return datetime.date.fromtimestamp(timestamp)
+
+def local_utc_offset() -> str:
+    # Server's current UTC offset (e.g. "+0200") for MongoDB's date operators; a DST change moves noon
+    # by at most an hour, so the current offset gives the same date for every logged item
+    return datetime.datetime.now().astimezone().strftime("%z")
+
+def bucket_start(day: datetime.date, bucket: str) -> datetime.date:
+    match bucket:
+        case "day":
+            return day
+        case "week":
+            return day - datetime.timedelta(days=day.weekday())
+        case "month":
+            return day.replace(day=1)
+    raise Exception(f"Invalid bucket: {bucket}, allowed values: {TOTALS_BUCKETS}")
+
+def scaled_nutrients(food_item: FoodItem, quantity: float) -> dict[str, float]:
+    # Nutrients of quantity grams of the given food item
+    food_item_dict: dict[str, Any] = FoodItemConverter.to_dict(food_item, normalized_weight=True, quantity_multiplier=quantity/100.0)
+    return {field: food_item_dict[field] for field in ROLLUP_FIELDS}
+
+def update_rollup(user_id: str, timestamp: float, nutrients: dict[str, float], item_count: int):
+    # Atomically add (or, with negative item_count, subtract) logged items to user's daily rollup
+    sign: float = 1.0 if item_count >= 0 else -1.0
+    day: str = timestamp_to_day(timestamp).isoformat()
+    increments: dict[str, Any] = {f"inc__{field}": sign * nutrients[field] for field in ROLLUP_FIELDS}
+    DailyRollup.objects(user_id=user_id, day=day).update_one(upsert=True, inc__item_count=item_count, **increments)
+    if item_count < 0:
+        DailyRollup.objects(user_id=user_id, day=day, item_count__lte=0).delete()
+
+def delete_rollups_for_user(user_id: str):
+    DailyRollup.objects(user_id=user_id).delete()
+
+def get_rollup_totals(user_id: str, from_date: datetime.date, to_date: datetime.date, bucket: str) -> list[dict[str, Any]]:
+    # Reads at most one rollup document per day in range and sums them per bucket
+    if bucket not in TOTALS_BUCKETS:
+        raise Exception(f"Invalid bucket: {bucket}, allowed values: {TOTALS_BUCKETS}")
+    rollups: Iterator[dict[str, Any]] = DailyRollup.objects(
+        user_id=user_id,
+        day__gte=from_date.isoformat(),
+        day__lte=to_date.isoformat(),
+    ).order_by("day").as_pymongo()
+    totals: dict[datetime.date, dict[str, Any]] = {}
+    for rollup in rollups:
+        start: datetime.date = bucket_start(datetime.date.fromisoformat(rollup["day"]), bucket)
+        total: dict[str, Any] = totals.setdefault(start, {"start": start, "item_count": 0, **{field: 0.0 for field in ROLLUP_FIELDS}})
+        total["item_count"] += rollup.get("item_count", 0)
+        for field in ROLLUP_FIELDS:
+            total[field] += rollup.get(field, 0.0)
+    return list(totals.values())
+
+def aggregate_daily_totals(user_id: str | None = None, day: datetime.date | None = None) -> Iterator[dict[str, Any]]:
+    # Computes daily rollups from raw logged items (for rebuilding and verifying the rollup collection)
+    match: dict[str, Any] = {"user_id": user_id} if user_id is not None else {}
+    if day is not None:
+        day_start: datetime.datetime = datetime.datetime(day.year, day.month, day.day)
+        match["timestamp"] = {"$gte": day_start.timestamp(), "$lt": (day_start + datetime.timedelta(days=1)).timestamp()}
+    group: dict[str, Any] = {
+        "_id": {"user_id": "$user_id", "day": "$day"},
+        "item_count": {"$sum": 1},
+        "weight_g": {"$sum": "$quantity"},
+    }
+    for field in NUTRIENT_FIELDS:
+        # Nutrient snapshot if present, otherwise food item's nutrients (stored per weight_g grams) scaled by quantity (in grams)
+        group[field] = {"$sum": {"$ifNull": [f"$nutrients.{field}", {"$multiply": [f"$food_item.{field}", "$multiplier"]}]}}
+    pipeline: list[dict[str, Any]] = [
+        {"$match": match},
+        {"$addFields": {"food_item_oid": {"$toObjectId": "$food_item_id"}}},
+        {"$lookup": {"from": FoodItem._get_collection_name(), "localField": "food_item_oid", "foreignField": "_id", "as": "food_item"}},
+        # Items with a nutrient snapshot are counted even if their food item no longer exists
+        {"$unwind": {"path": "$food_item", "preserveNullAndEmptyArrays": True}},
+        {"$match": {"$or": [{"food_item": {"$exists": True}}, {"nutrients.calories": {"$exists": True}}]}},
+        {"$addFields": {
+            "day": {"$dateToString": {"date": {"$toDate": {"$multiply": ["$timestamp", 1000]}}, "format": "%Y-%m-%d", "timezone": local_utc_offset()}},
+            "multiplier": {"$divide": ["$quantity", "$food_item.weight_g"]},
+        }},
+        {"$group": group},
+    ]
+    for result in LoggedItem.objects.aggregate(pipeline, allowDiskUse=True):
+        key: dict[str, str] = result.pop("_id")
+        yield {"user_id": key["user_id"], "day": key["day"], **result}
+
+def rebuild_rollup_day(user_id: str, day: datetime.date):
+    # Recomputes one rollup from raw logged items, for when a deleted item's nutrients are unknown
+    # (no snapshot and its food item no longer exists), so they cannot be subtracted
+    rollups: list[dict[str, Any]] = list(aggregate_daily_totals(user_id, day))
+    if not rollups:
+        DailyRollup.objects(user_id=user_id, day=day.isoformat()).delete()
+        return
+    DailyRollup._get_collection().replace_one({"user_id": user_id, "day": day.isoformat()}, rollups[0], upsert=True)
+
+def rebuild_rollups(user_id: str | None = None) -> int:
+    # Replaces rollups (of given user, or of all users) with ones computed from raw logged items.
+    # Offline only: items logged or deleted while the aggregation runs would be lost or counted twice
+    if user_id is not None:
+        delete_rollups_for_user(user_id)
+    else:
+        DailyRollup.objects.delete()
+    collection: Collection = DailyRollup._get_collection()
+    operations: list[ReplaceOne] = []
+    count: int = 0
+    for rollup in aggregate_daily_totals(user_id):
+        operations.append(ReplaceOne({"user_id": rollup["user_id"], "day": rollup["day"]}, rollup, upsert=True))
+        if len(operations) >= REBUILD_BATCH_SIZE:
+            collection.bulk_write(operations, ordered=False)
+            count += len(operations)
+            operations = []
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        count += len(operations)
+    return count
+
+def verify_rollups(user_id: str | None = None, tolerance: float = 1e-6) -> list[str]:
+    # Returns descriptions of rollups that do not match raw logged items
+    stored: dict[tuple[str, str], dict[str, Any]] = {
+        (rollup["user_id"], rollup["day"]): rollup
+        for rollup in (DailyRollup.objects(user_id=user_id) if user_id is not None else DailyRollup.objects).as_pymongo()
+    }
+    mismatches: list[str] = []
+    for expected in aggregate_daily_totals(user_id):
+        key: tuple[str, str] = (expected["user_id"], expected["day"])
+        actual: dict[str, Any] | None = stored.pop(key, None)
+        if actual is None:
+            mismatches.append(f"Missing rollup for user {key[0]} on {key[1]}")
+            continue
+        for field in ["item_count"] + ROLLUP_FIELDS:
+            if abs(actual.get(field, 0.0) - expected[field]) > tolerance * max(1.0, abs(expected[field])):
+                mismatches.append(f"Rollup for user {key[0]} on {key[1]}: {field}={actual.get(field, 0.0)}, expected {expected[field]}")
+    for key in stored.keys():
+        mismatches.append(f"Rollup for user {key[0]} on {key[1]} has no logged items")
+    return mismatches
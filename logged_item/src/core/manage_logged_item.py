@@ -1,89 +1,265 @@
-from typing import Any
+from typing import Any, Callable, Iterator, TypeVar
 from bson import ObjectId
+from bson.errors import InvalidId
+from mongoengine import Q
+from mongoengine.queryset.queryset import QuerySet
+from pymongo.errors import BulkWriteError
+from gevent.greenlet import Greenlet
+from gevent.pool import Pool
 from dotenv import load_dotenv
-from food_item.src.models.converters.food_item_converter import FoodItemConverter
+from food_item.src.models.converters.food_item_converter import NUTRIENT_FIELDS, FoodItemConverter
 from food_item.src.models.entities.food_item import FoodItem
+from logged_item.src.core import service_clients
+from logged_item.src.core.service_clients import remaining
+from logged_item.src.core.daily_rollup import ROLLUP_FIELDS, delete_rollups_for_user, get_rollup_totals, rebuild_rollup_day, scaled_nutrients, timestamp_to_day, update_rollup
+from logged_item.src.models.converters.logged_item_converter import LoggedItemConverter
 from logged_item.src.models.entities.logged_item import LoggedItem
+from shared.src.core.cache import TTLCache
 import requests
+import gevent
 import os
 import json
+import base64
+import binascii
 import datetime
+import time
+
+T = TypeVar("T")
 
 RESPONSE_ENCODING: str = "utf-8"
 
 load_dotenv()
 
+# Ids of users that user_info recently confirmed to exist
+KNOWN_USERS_CACHE: TTLCache[str, bool] = TTLCache(
+    name="known_users",
+    maxsize=int(os.environ.get("KNOWN_USERS_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("KNOWN_USERS_CACHE_TTL", 300)),
+)
+# Store food name and scaled nutrients on newly logged items
+NUTRIENT_SNAPSHOT: bool = os.environ.get("LOGGED_ITEM_NUTRIENT_SNAPSHOT", "false").lower() in ["1", "true", "yes"]
+# Number of logged items read from MongoDB (and joined with food items) at once
+HISTORY_BATCH_SIZE: int = int(os.environ.get("LOGGED_ITEM_HISTORY_BATCH_SIZE", 500))
+# Calls to food_item and user_info made while logging items run concurrently in this pool, within a shared deadline
+DOWNSTREAM_POOL: Pool = Pool(int(os.environ.get("LOGGED_ITEM_DOWNSTREAM_POOL_SIZE", 200)))
+DOWNSTREAM_DEADLINE: float = float(os.environ.get("LOGGED_ITEM_DOWNSTREAM_DEADLINE", 10))
+
 def get_logged_item(id: str) -> LoggedItem | None:
     result: list[LoggedItem] = list(LoggedItem.objects(pk=ObjectId(id)))
     return result[0] if result else None
 
-def add_item_to_user(user_id: str, date: datetime.date, data: dict[str, str]) -> LoggedItem | tuple[str, int]:
-    
-    # Parse request body
+def check_user_exists(user_id: str, deadline: float | None = None) -> tuple[str, int] | None:
+    # Returns None if user exists, otherwise an error message and status code
+    if KNOWN_USERS_CACHE.get(user_id):
+        return None
+    user_error: tuple[str, int] | None = service_clients.USER_INFO_CLIENT.check_user(user_id, deadline)
+    if user_error is not None:
+        return user_error
+    KNOWN_USERS_CACHE.set(user_id, True)
+    return None
+
+def forget_user(user_id: str):
+    KNOWN_USERS_CACHE.delete(user_id)
+
+def with_user_check(user_id: str, fetch: Callable[[float], T]) -> T | tuple[str, int]:
+    # Checks that the user exists while fetch(deadline) runs, so latency is the slower of the two calls instead of their sum.
+    # Returns the result of fetch, or an error message and status code (the fetch is cancelled if the user check fails)
+    deadline: float = time.monotonic() + DOWNSTREAM_DEADLINE
+    user_greenlet: Greenlet = DOWNSTREAM_POOL.spawn(check_user_exists, user_id, deadline)
+    fetch_greenlet: Greenlet = DOWNSTREAM_POOL.spawn(fetch, deadline)
+    try:
+        user_error: tuple[str, int] | None = user_greenlet.get(timeout=remaining(deadline))
+        if user_error is not None:
+            return user_error
+        return fetch_greenlet.get(timeout=remaining(deadline))
+    except (gevent.Timeout, requests.exceptions.Timeout):
+        return f"Downstream services did not respond within {DOWNSTREAM_DEADLINE}s", 504
+    finally:
+        # Has no effect on finished greenlets
+        user_greenlet.kill(block=False)
+        fetch_greenlet.kill(block=False)
+
+def get_remaining_nutrients(user_id: str, date: datetime.date) -> dict[str, dict[str, float]] | tuple[str, int]:
+    # Consumed, target (daily RDA) and remaining amount of each nutrient on given date, or an error message and status code.
+    # RDA (which also tells whether the user exists) and consumed totals are fetched concurrently, within a shared deadline
+    deadline: float = time.monotonic() + DOWNSTREAM_DEADLINE
+    rda_greenlet: Greenlet = DOWNSTREAM_POOL.spawn(service_clients.USER_INFO_CLIENT.get_daily_rda, user_id, deadline)
+    totals_greenlet: Greenlet = DOWNSTREAM_POOL.spawn(get_rollup_totals, user_id, date, date, "day")
+    try:
+        daily_rda: dict[str, Any] | tuple[str, int] = rda_greenlet.get(timeout=remaining(deadline))
+        if isinstance(daily_rda, tuple):
+            return daily_rda
+        KNOWN_USERS_CACHE.set(user_id, True)
+        totals: list[dict[str, Any]] = totals_greenlet.get(timeout=remaining(deadline))
+    except (gevent.Timeout, requests.exceptions.Timeout):
+        return f"Downstream services did not respond within {DOWNSTREAM_DEADLINE}s", 504
+    finally:
+        # Has no effect on finished greenlets
+        rda_greenlet.kill(block=False)
+        totals_greenlet.kill(block=False)
+    consumed: dict[str, Any] = totals[0] if totals else {}
+    nutrients: dict[str, dict[str, float]] = {}
+    for field in NUTRIENT_FIELDS:
+        target: float = float(daily_rda.get(field, 0.0))
+        nutrients[field] = {
+            "consumed": consumed.get(field, 0.0),
+            "target": target,
+            "remaining": target - consumed.get(field, 0.0),
+        }
+    return nutrients
+
+def parse_item(data: dict[str, Any]) -> tuple[str, int] | str:
+    # Returns food name and weight, or an error message
     food_name: str = str(data.get("food_name", "")).strip()
     weight_str: str = str(data.get("weight", "")).strip()
     if not food_name:
-        return "Food name cannot be empty", 400
+        return "Food name cannot be empty"
     if not weight_str:
-        return "Weight cannot be empty", 400
-    weight: int = 0
+        return "Weight cannot be empty"
     try:
-        weight = int(float(weight_str))
+        return food_name, int(float(weight_str))
     except ValueError:
-        return "Failed to cast weight to number", 400
-    
-    # Fetch food item from API
-    response: requests.Response = requests.get(f"{os.environ['BACKEND_URL']}/api/v1/food_item/{food_name}")
-    if not response.ok:
-        return response.text, response.status_code
-    if not response.content:
-        return f"The queried food \"{data['food_name']}\" is unfortunately not available", 200
-    content: dict[str, Any] = json.loads(response.content.decode(RESPONSE_ENCODING))
-    food_item_dict: dict[str, Any] = content["food_item"]
-    food_item: FoodItem = FoodItemConverter.to_entity(food_item_dict)
+        return "Failed to cast weight to number"
 
-    # Check if user exists
-    response = requests.get(f"{os.environ['BACKEND_URL']}/api/v1/user_info/id/{user_id}")
-    if response.status_code == 404:
-        return f"User with id {user_id} does not exist", 404
-    if not response.ok:
-        return f"Failed to check if user exists: {response.text=}", response.status_code
-    
-    # Create arbitrary timestamp on specified date
-    timestamp: float = datetime.datetime(date.year, date.month, date.day, 12, 0, 0).timestamp()
-    
-    # Create new logged item
+def new_logged_item(user_id: str, timestamp: float, weight: int, food_item: FoodItem, nutrients: dict[str, float]) -> LoggedItem:
     logged_item: LoggedItem = LoggedItem(
         timestamp=timestamp,
         quantity=weight,
         user_id=user_id,
         food_item_id=str(food_item.pk),
     )
+    if NUTRIENT_SNAPSHOT:
+        logged_item.food_name = food_item.name
+        logged_item.nutrients = nutrients
+    return logged_item
+
+def add_item_to_user(user_id: str, date: datetime.date, data: dict[str, str]) -> LoggedItem | tuple[str, int]:
+    
+    # Parse request body
+    item: tuple[str, int] | str = parse_item(data)
+    if isinstance(item, str):
+        return item, 400
+    food_name, weight = item
+    
+    # Fetch food item from API while checking if user exists
+    food_item: FoodItem | tuple[str, int] = with_user_check(user_id, lambda deadline: service_clients.FOOD_ITEM_CLIENT.get_food_item(food_name, deadline))
+    if isinstance(food_item, tuple):
+        return food_item
+    
+    # Create arbitrary timestamp on specified date
+    timestamp: float = datetime.datetime(date.year, date.month, date.day, 12, 0, 0).timestamp()
+    
+    # Create new logged item
+    nutrients: dict[str, float] = scaled_nutrients(food_item, weight)
+    logged_item: LoggedItem = new_logged_item(user_id, timestamp, weight, food_item, nutrients)
     logged_item.save()
+    update_rollup(user_id, timestamp, nutrients, 1)
     return logged_item
 
-def get_logged_items(user_id: str, from_date: datetime.date, to_date: datetime.date) -> list[dict[str, Any]]:
+def add_items_to_user(user_id: str, date: datetime.date, entries: list[dict[str, Any]]) -> list[dict[str, Any]] | tuple[str, int]:
+    # Logs several items at once and returns a result per entry (logged item or error, with status),
+    # or an error message and status code if the whole request failed
 
-    # Check if user exists
-    response = requests.get(f"{os.environ['BACKEND_URL']}/api/v1/user_info/id/{user_id}")
-    if response.status_code == 404:
-        raise Exception(f"User with id {user_id} does not exist")
-    if not response.ok:
-        raise Exception(f"Failed to check if user exists: {response.status_code=}, {response.text=}")
+    # Parse entries
+    results: list[dict[str, Any]] = [{} for _ in entries]
+    items: dict[int, tuple[str, int]] = {}
+    for index, data in enumerate(entries):
+        item: tuple[str, int] | str = parse_item(data)
+        if isinstance(item, str):
+            results[index] = {"error": item, "status": 400}
+        else:
+            items[index] = item
 
-    # Get list of logged items
+    if not items:
+        user_error: tuple[str, int] | None = check_user_exists(user_id)
+        return user_error if user_error is not None else results
+
+    # Fetch all food items from API in one request (food_item matches names case-insensitively) while checking if user exists
+    food_names: list[str] = list(dict.fromkeys(food_name.lower() for food_name, _ in items.values()))
+    food_results: dict[str, dict[str, Any]] | tuple[str, int] = with_user_check(user_id, lambda deadline: service_clients.FOOD_ITEM_CLIENT.get_food_items(food_names, deadline))
+    if isinstance(food_results, tuple):
+        return food_results
+
+    # Create new logged items
+    timestamp: float = datetime.datetime(date.year, date.month, date.day, 12, 0, 0).timestamp()
+    new_items: dict[int, tuple[LoggedItem, dict[str, float]]] = {}
+    for index, (food_name, weight) in items.items():
+        food_result: dict[str, Any] = food_results.get(food_name.lower(), {"error": f"Food item {food_name} was not resolved", "status": 502})
+        if "food_item" not in food_result:
+            results[index] = {"error": food_result["error"], "status": food_result["status"]}
+            continue
+        food_item: FoodItem = FoodItemConverter.to_entity(food_result["food_item"])
+        nutrients: dict[str, float] = scaled_nutrients(food_item, weight)
+        logged_item: LoggedItem = new_logged_item(user_id, timestamp, weight, food_item, nutrients)
+        # Ids are assigned here, so inserted documents and returned items share them
+        logged_item.pk = ObjectId()
+        new_items[index] = logged_item, nutrients
+    if not new_items:
+        return results
+
+    # Insert all items with one unordered write, so a failed item does not prevent others from being inserted
+    indices: list[int] = list(new_items.keys())
+    failed: dict[int, str] = {}
+    try:
+        LoggedItem._get_collection().insert_many([new_items[index][0].to_mongo() for index in indices], ordered=False)
+    except BulkWriteError as e:
+        failed = {indices[error["index"]]: error.get("errmsg", "") for error in e.details.get("writeErrors", [])}
+    rollup: dict[str, float] = {field: 0.0 for field in ROLLUP_FIELDS}
+    inserted: int = 0
+    for index in indices:
+        logged_item, nutrients = new_items[index]
+        if index in failed:
+            results[index] = {"error": f"Failed to log item: {failed[index]}", "status": 500}
+            continue
+        results[index] = {"logged_item": LoggedItemConverter.to_dict(logged_item), "status": 200}
+        for field in ROLLUP_FIELDS:
+            rollup[field] += nutrients[field]
+        inserted += 1
+
+    # All items are logged on the same day, so one rollup update covers them
+    if inserted:
+        update_rollup(user_id, timestamp, rollup, inserted)
+    return results
+
+def has_snapshot(logged_item: LoggedItem) -> bool:
+    return logged_item.food_name is not None and bool(logged_item.nutrients) and all(field in logged_item.nutrients for field in ROLLUP_FIELDS)
+
+def snapshot_to_dict(logged_item: LoggedItem) -> dict[str, Any]:
+    # Same shape as FoodItemConverter.to_dict of the scaled food item
+    return {"id": str(logged_item.pk), "name": logged_item.food_name, **{field: logged_item.nutrients[field] for field in ROLLUP_FIELDS}}
+
+def encode_cursor(logged_item: LoggedItem) -> str:
+    # Opaque cursor pointing after given item in (timestamp, _id) order
+    return base64.urlsafe_b64encode(json.dumps([logged_item.timestamp, str(logged_item.pk)]).encode(RESPONSE_ENCODING)).decode(RESPONSE_ENCODING)
+
+def decode_cursor(cursor: str) -> tuple[float, ObjectId]:
+    try:
+        timestamp, id = json.loads(base64.urlsafe_b64decode(cursor.encode(RESPONSE_ENCODING)))
+        return float(timestamp), ObjectId(id)
+    except (binascii.Error, UnicodeDecodeError, InvalidId, TypeError, ValueError):
+        raise Exception(f"Invalid cursor: {cursor}")
+
+def query_logged_items(user_id: str, from_date: datetime.date, to_date: datetime.date, cursor: str | None = None) -> QuerySet:
+    # User's items within date range ordered by (timestamp, _id), optionally only those after the cursor
     from_timestamp: float = datetime.datetime(from_date.year, from_date.month, from_date.day, 0, 0, 0).timestamp()
     to_timestamp: float = datetime.datetime(to_date.year, to_date.month, to_date.day, 23, 59, 59).timestamp()
-    logged_items: list[LoggedItem] = list(LoggedItem.objects(
-        user_id=user_id,
-        timestamp__gte=from_timestamp,
-        timestamp__lte=to_timestamp,
-    ))
-    
+    query: Q = Q(user_id=user_id, timestamp__gte=from_timestamp, timestamp__lte=to_timestamp)
+    if cursor is not None:
+        after_timestamp, after_id = decode_cursor(cursor)
+        query &= Q(timestamp__gt=after_timestamp) | Q(timestamp=after_timestamp, id__gt=after_id)
+    return LoggedItem.objects(query).order_by("timestamp", "id")
+
+def logged_items_to_dicts(logged_items: list[LoggedItem]) -> list[dict[str, Any]]:
+    # Fetch food items of items without a nutrient snapshot with a single query
+    food_items: dict[str, FoodItem] = logged_items_to_food_items([logged_item for logged_item in logged_items if not has_snapshot(logged_item)])
+
     # Build list of logged items
     logged_items_list: list[dict[str, Any]] = []
     for logged_item in logged_items:
-        food_item: FoodItem | None = logged_item_to_food_item(logged_item)
+        if has_snapshot(logged_item):
+            logged_items_list.append(snapshot_to_dict(logged_item))
+            continue
+        food_item: FoodItem | None = food_items.get(logged_item.food_item_id)
         if food_item is None:
             raise Exception(f"Failed to find {logged_item.food_item_id=}")
         food_item_dict: dict[str, Any] = FoodItemConverter.to_dict(food_item, normalized_weight=True, quantity_multiplier=logged_item.quantity/100.0)
@@ -91,18 +267,87 @@ def get_logged_items(user_id: str, from_date: datetime.date, to_date: datetime.d
         logged_items_list.append(food_item_dict)
     return logged_items_list
 
-def logged_item_to_food_item(logged_item: LoggedItem) -> FoodItem | None:
-    # Maybe do a requery if this specific food item is no longer present in database?
-    food_items: list[FoodItem] = list(FoodItem.objects(pk=ObjectId(logged_item.food_item_id)))
-    return food_items[0] if food_items else None
+def get_logged_items(user_id: str, from_date: datetime.date, to_date: datetime.date) -> list[dict[str, Any]]:
+    return get_logged_items_page(user_id, from_date, to_date)[0]
+
+def get_logged_items_page(user_id: str, from_date: datetime.date, to_date: datetime.date, cursor: str | None = None, limit: int | None = None) -> tuple[list[dict[str, Any]], str | None]:
+    # Returns up to limit items after the cursor and the cursor of the next page (None if this is the last page)
+
+    # Check if user exists
+    user_error: tuple[str, int] | None = check_user_exists(user_id)
+    if user_error is not None:
+        raise Exception(user_error[0])
+
+    # Get list of logged items (one more than limit, to know whether there is a next page)
+    query_set: QuerySet = query_logged_items(user_id, from_date, to_date, cursor)
+    if limit is not None:
+        query_set = query_set.limit(limit + 1)
+    logged_items: list[LoggedItem] = list(query_set)
+    next_cursor: str | None = None
+    if limit is not None and len(logged_items) > limit:
+        logged_items = logged_items[:limit]
+        next_cursor = encode_cursor(logged_items[-1])
+    return logged_items_to_dicts(logged_items), next_cursor
+
+def stream_logged_items(user_id: str, from_date: datetime.date, to_date: datetime.date, cursor: str | None = None) -> Iterator[dict[str, Any]]:
+    # Checks the user and the cursor right away, items are then read from a MongoDB cursor and joined batch by batch,
+    # so memory use does not depend on the length of user's history
+
+    # Check if user exists
+    user_error: tuple[str, int] | None = check_user_exists(user_id)
+    if user_error is not None:
+        raise Exception(user_error[0])
+    query_set: QuerySet = query_logged_items(user_id, from_date, to_date, cursor).batch_size(HISTORY_BATCH_SIZE)
+
+    def generate() -> Iterator[dict[str, Any]]:
+        batch: list[LoggedItem] = []
+        for logged_item in query_set:
+            batch.append(logged_item)
+            if len(batch) >= HISTORY_BATCH_SIZE:
+                yield from logged_items_to_dicts(batch)
+                batch = []
+        yield from logged_items_to_dicts(batch)
+    return generate()
+
+def get_logged_item_totals(user_id: str, from_date: datetime.date, to_date: datetime.date, bucket: str) -> list[dict[str, Any]]:
+
+    # Check if user exists
+    user_error: tuple[str, int] | None = check_user_exists(user_id)
+    if user_error is not None:
+        raise Exception(user_error[0])
+
+    # Sum user's daily rollups per bucket
+    return get_rollup_totals(user_id, from_date, to_date, bucket)
+
+def logged_items_to_food_items(logged_items: list[LoggedItem]) -> dict[str, FoodItem]:
+    # Maps each distinct food_item_id to its food item (missing food items are left out)
+    # Maybe do a requery if some food item is no longer present in database?
+    food_item_ids: set[str] = {logged_item.food_item_id for logged_item in logged_items}
+    if not food_item_ids:
+        return {}
+    food_items: list[FoodItem] = list(FoodItem.objects(pk__in=[ObjectId(food_item_id) for food_item_id in food_item_ids]))
+    return {str(food_item.pk): food_item for food_item in food_items}
 
 def delete_logged_item(logged_item_id: str) -> bool:
     logged_items: list[LoggedItem] = list(LoggedItem.objects(pk=ObjectId(logged_item_id)))
     if not logged_items:
         return False
-    logged_items[0].delete()
+    logged_item: LoggedItem = logged_items[0]
+    logged_item.delete()
+    if has_snapshot(logged_item):
+        update_rollup(logged_item.user_id, logged_item.timestamp, logged_item.nutrients, -1)
+        return True
+    food_item: FoodItem | None = logged_items_to_food_items([logged_item]).get(logged_item.food_item_id)
+    if food_item is not None:
+        update_rollup(logged_item.user_id, logged_item.timestamp, scaled_nutrients(food_item, logged_item.quantity), -1)
+    else:
+        # Nutrients that were added to the rollup are unknown, so recompute the day instead of letting it drift
+        rebuild_rollup_day(logged_item.user_id, timestamp_to_day(logged_item.timestamp))
     return True
 
 def delete_logged_items_for_user(user_id: str):
+    # Called by user_info when the user is being deleted
+    forget_user(user_id)
+    delete_rollups_for_user(user_id)
     return LoggedItem.objects(user_id=user_id).delete()
 
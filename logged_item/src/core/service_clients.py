@@ -0,0 +1,108 @@
+from abc import ABC, abstractmethod
+from typing import Any
+from food_item.src.models.converters.food_item_converter import FoodItemConverter
+from food_item.src.models.entities.food_item import FoodItem
+from shared.src.core.http_client import HTTP_CLIENT
+from dotenv import load_dotenv
+import requests
+import json
+import os
+import time
+
+RESPONSE_ENCODING: str = "utf-8"
+SERVICE_TRANSPORTS: list[str] = ["http", "inprocess"]
+
+load_dotenv()
+
+def remaining(deadline: float | None) -> float | None:
+    # Timeout of a request that must finish before the deadline (requests does not accept zero timeouts)
+    return None if deadline is None else max(deadline - time.monotonic(), 0.001)
+
+class FoodItemClient(ABC):
+    @abstractmethod
+    def get_food_item(self, food_name: str, deadline: float | None = None) -> FoodItem | tuple[str, int]:
+        # Returns food item, or an error message and status code
+        ...
+    @abstractmethod
+    def get_food_items(self, food_names: list[str], deadline: float | None = None) -> dict[str, dict[str, Any]] | tuple[str, int]:
+        # Returns results of food_item's batch endpoint by query, or an error message and status code
+        ...
+
+class HttpFoodItemClient(FoodItemClient):
+    def get_food_item(self, food_name: str, deadline: float | None = None) -> FoodItem | tuple[str, int]:
+        response: requests.Response = HTTP_CLIENT.get(f"{os.environ['BACKEND_URL']}/api/v1/food_item/{food_name}", "food_item", timeout=remaining(deadline))
+        if not response.ok:
+            return response.text, response.status_code
+        if not response.content:
+            return f"The queried food \"{food_name}\" is unfortunately not available", 200
+        content: dict[str, Any] = json.loads(response.content.decode(RESPONSE_ENCODING))
+        return FoodItemConverter.to_entity(content["food_item"])
+    def get_food_items(self, food_names: list[str], deadline: float | None = None) -> dict[str, dict[str, Any]] | tuple[str, int]:
+        response: requests.Response = HTTP_CLIENT.post(f"{os.environ['BACKEND_URL']}/api/v1/food_item/batch", "food_item", json={"queries": food_names}, timeout=remaining(deadline))
+        if not response.ok:
+            return response.text, response.status_code
+        return json.loads(response.content.decode(RESPONSE_ENCODING))["food_items"]
+
+class InProcessFoodItemClient(FoodItemClient):
+    # Calls food_item's core directly (services share one process), skipping HTTP serialization and dispatch
+    def get_food_item(self, food_name: str, deadline: float | None = None) -> FoodItem | tuple[str, int]:
+        from food_item.src.core.manage_food_item import get_nutrition_facts
+        return get_nutrition_facts(food_name)
+    def get_food_items(self, food_names: list[str], deadline: float | None = None) -> dict[str, dict[str, Any]] | tuple[str, int]:
+        from food_item.src.core.manage_food_item import batch_results_to_dict, get_nutrition_facts_batch
+        return batch_results_to_dict(food_names, get_nutrition_facts_batch(food_names))
+
+class UserInfoClient(ABC):
+    @abstractmethod
+    def check_user(self, user_id: str, deadline: float | None = None) -> tuple[str, int] | None:
+        # Returns None if user exists, otherwise an error message and status code
+        ...
+    @abstractmethod
+    def get_daily_rda(self, user_id: str, deadline: float | None = None) -> dict[str, Any] | tuple[str, int]:
+        # Returns user's daily RDA values, or an error message and status code (404 if user does not exist)
+        ...
+
+class HttpUserInfoClient(UserInfoClient):
+    def check_user(self, user_id: str, deadline: float | None = None) -> tuple[str, int] | None:
+        response: requests.Response = HTTP_CLIENT.get(f"{os.environ['BACKEND_URL']}/api/v1/user_info/id/{user_id}", "user_info", timeout=remaining(deadline))
+        if response.status_code == 404:
+            return f"User with id {user_id} does not exist", 404
+        if not response.ok:
+            return f"Failed to check if user exists: {response.status_code=}, {response.text=}", response.status_code
+        return None
+    def get_daily_rda(self, user_id: str, deadline: float | None = None) -> dict[str, Any] | tuple[str, int]:
+        response: requests.Response = HTTP_CLIENT.get(f"{os.environ['BACKEND_URL']}/api/v1/user_info/daily_rda/{user_id}", "user_info", timeout=remaining(deadline))
+        if response.status_code == 404:
+            return f"User with id {user_id} does not exist", 404
+        if not response.ok:
+            return f"Failed to get user's daily RDA: {response.status_code=}, {response.text=}", response.status_code
+        return json.loads(response.content.decode(RESPONSE_ENCODING))
+
+class InProcessUserInfoClient(UserInfoClient):
+    # Calls user_info's core directly (services share one process)
+    def check_user(self, user_id: str, deadline: float | None = None) -> tuple[str, int] | None:
+        from user_info.src.core.manage_user_info import get_user_info
+        if get_user_info(user_id) is None:
+            return f"User with id {user_id} does not exist", 404
+        return None
+    def get_daily_rda(self, user_id: str, deadline: float | None = None) -> dict[str, Any] | tuple[str, int]:
+        from user_info.src.core.daily_rda import get_daily_rda
+        from user_info.src.core.manage_user_info import get_user_info
+        user: Any = get_user_info(user_id)
+        if user is None:
+            return f"User with id {user_id} does not exist", 404
+        return get_daily_rda(user)
+
+def make_clients(transport: str) -> tuple[FoodItemClient, UserInfoClient]:
+    if transport not in SERVICE_TRANSPORTS:
+        raise Exception(f"Invalid service transport: {transport}, allowed values: {SERVICE_TRANSPORTS}")
+    if transport == "inprocess":
+        return InProcessFoodItemClient(), InProcessUserInfoClient()
+    return HttpFoodItemClient(), HttpUserInfoClient()
+
+FOOD_ITEM_CLIENT, USER_INFO_CLIENT = make_clients(os.environ.get("SERVICE_TRANSPORT", "http").lower())
+
+def use_transport(transport: str):
+    # Used by the combined deployment (api.py), where all services share one process
+    global FOOD_ITEM_CLIENT, USER_INFO_CLIENT
+    FOOD_ITEM_CLIENT, USER_INFO_CLIENT = make_clients(transport)
@@ -0,0 +1,23 @@
+import mongoengine as me
+
+class DailyRollup(me.Document):
+    user_id: str = me.StringField(required=True)
+    day: str = me.StringField(required=True)
+    item_count: int = me.IntField(default=0)
+    weight_g: float = me.FloatField(default=0.0)
+    calories: float = me.FloatField(default=0.0)
+    fat_total: float = me.FloatField(default=0.0)
+    fat_saturated: float = me.FloatField(default=0.0)
+    protein: float = me.FloatField(default=0.0)
+    carbohydrates: float = me.FloatField(default=0.0)
+    fiber: float = me.FloatField(default=0.0)
+    sugar: float = me.FloatField(default=0.0)
+    sodium: float = me.FloatField(default=0.0)
+    potassium: float = me.FloatField(default=0.0)
+    cholesterol: float = me.FloatField(default=0.0)
+    meta = {
+        "indexes": [
+            # One document per user and day (ISO format, so ranges sort correctly)
+            {"fields": ("user_id", "day"), "unique": True},
+        ],
+    }
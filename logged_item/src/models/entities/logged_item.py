@@ -5,4 +5,13 @@ class LoggedItem(me.Document):
     quantity: float = me.FloatField(required=True)
     user_id: str = me.StringField(required=True)
     food_item_id: str = me.StringField(required=True)
-
+    # Optional snapshot taken when the item is logged (name and nutrients already scaled by quantity),
+    # so history reads do not need to join food items
+    food_name: str | None = me.StringField()
+    nutrients: dict[str, float] = me.DictField()
+    meta = {
+        "indexes": [
+            # History queries (user_id + timestamp range, paginated by timestamp and _id) and deletion of user's items (user_id)
+            ("user_id", "timestamp", "id"),
+        ],
+    }
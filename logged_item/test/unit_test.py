@@ -0,0 +1,396 @@
+from typing import Any
+from flask.testing import FlaskClient
+from logged_item.src.api.v1.api import app
+from food_item.src.models.entities.food_item import FoodItem
+from logged_item.src.models.entities.logged_item import LoggedItem
+from logged_item.src.core.manage_logged_item import KNOWN_USERS_CACHE, encode_cursor, query_logged_items
+from logged_item.src.core.daily_rollup import rebuild_rollups, timestamp_to_day, verify_rollups
+from logged_item.src.cli.backfill_snapshots import backfill_snapshots
+from logged_item.src.core import service_clients
+from user_info.src.models.entities.user_info import UserInfo
+from logged_item.src.models.entities.daily_rollup import DailyRollup
+from food_item.src.models.converters.food_item_converter import FoodItemConverter
+from shared.src.core.http_client import HTTP_CLIENT
+from shared.test.query_plan import assert_no_collscan
+import pytest
+from pymongo.monitoring import CommandListener, CommandStartedEvent, CommandSucceededEvent, CommandFailedEvent
+from pymongo.synchronous.database import Database
+from pymongo.synchronous.mongo_client import MongoClient
+from mongoengine import disconnect_all, connect
+from dotenv import load_dotenv
+from bson import ObjectId
+import datetime
+import gevent
+import json
+import os
+import time
+from unittest import mock
+
+app.config["TESTING"] = True
+TEST_USER_ID: str = "67793ecb4917570eb704a0e9"
+TEST_FOODS: list[str] = ["apple", "banana", "rice"]
+load_dotenv()
+
+class QueryCounter(CommandListener):
+    # Counts find/aggregate commands sent to MongoDB, per collection
+    def __init__(self):
+        self.queries: dict[str, int] = {}
+    def started(self, event: CommandStartedEvent):
+        if event.command_name in ["find", "aggregate"]:
+            collection: str = event.command[event.command_name]
+            self.queries[collection] = self.queries.get(collection, 0) + 1
+    def succeeded(self, event: CommandSucceededEvent):
+        pass
+    def failed(self, event: CommandFailedEvent):
+        pass
+    def reset(self):
+        self.queries = {}
+
+QUERY_COUNTER: QueryCounter = QueryCounter()
+
+@pytest.fixture(scope="function")
+def database():
+    # Close connection with prod DB
+    disconnect_all()
+    # Make connection to test DB
+    client: MongoClient = connect(
+        db=os.environ["MONGO_DB_TEST"],
+        host=os.environ["MONGO_HOST"],
+        port=int(os.environ["MONGO_PORT"]),
+        username=os.environ["MONGO_USERNAME"],
+        password=os.environ["MONGO_PASSWORD"],
+        uuidRepresentation="standard",
+        event_listeners=[QUERY_COUNTER],
+    )
+    db: Database = client.get_database(os.environ["MONGO_DB_TEST"])
+    # Clear test DB
+    for collection in db.list_collection_names():
+        db.drop_collection(collection)
+    # Clear in-process caches
+    KNOWN_USERS_CACHE.clear()
+    # Run test
+    yield db
+    # Disconnect from DB
+    disconnect_all()
+
+@pytest.fixture
+def client() -> FlaskClient:
+    client: FlaskClient = app.test_client()
+    return client
+
+def create_logged_items(user_id: str, count: int) -> list[LoggedItem]:
+    # Create food items and log them in turns, one per day
+    food_items: list[FoodItem] = []
+    for name in TEST_FOODS:
+        food_item: FoodItem = FoodItem(name=name, calories=100.0, weight_g=100.0, fat_total=1.0, fat_saturated=0.5, protein=2.0, carbohydrates=20.0, fiber=2.0, sugar=10.0, sodium=1.0, potassium=100.0, cholesterol=0.0)
+        food_item.save()
+        food_items.append(food_item)
+    logged_items: list[LoggedItem] = []
+    for i in range(count):
+        date: datetime.date = datetime.date.today() - datetime.timedelta(days=i)
+        logged_item: LoggedItem = LoggedItem(
+            timestamp=datetime.datetime(date.year, date.month, date.day, 12, 0, 0).timestamp(),
+            quantity=50.0 * (i + 1),
+            user_id=user_id,
+            food_item_id=str(food_items[i % len(food_items)].pk),
+        )
+        logged_item.save()
+        logged_items.append(logged_item)
+    return logged_items
+
+def test_user_items_single_food_query(client: FlaskClient, database: Database):
+    # Log many items that reference a few food items
+    logged_items: list[LoggedItem] = create_logged_items(TEST_USER_ID, 20)
+    QUERY_COUNTER.reset()
+    with mock.patch.object(HTTP_CLIENT, "get") as mock_get:
+        # Simulate existing user
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.ok = True
+        resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}?from=01/01/2000")
+    assert resp.json is not None
+    assert resp.status_code == 200
+    # Check that all items are returned, with nutrients scaled by quantity
+    returned: dict[str, dict] = {item["id"]: item for item in resp.json["logged_items"]}
+    assert set(returned.keys()) == {str(logged_item.pk) for logged_item in logged_items}
+    for logged_item in logged_items:
+        assert returned[str(logged_item.pk)]["calories"] == pytest.approx(logged_item.quantity)
+        assert returned[str(logged_item.pk)]["weight_g"] == pytest.approx(logged_item.quantity)
+    # Food items must be fetched with a single query, regardless of the number of logged items
+    assert QUERY_COUNTER.queries.get(FoodItem._get_collection_name()) == 1
+    assert QUERY_COUNTER.queries.get(LoggedItem._get_collection_name()) == 1
+
+def test_user_items_snapshot(client: FlaskClient, database: Database):
+    logged_items: list[LoggedItem] = create_logged_items(TEST_USER_ID, 20)
+    # Backfill nutrient snapshots of existing items
+    stats: dict[str, int] = backfill_snapshots(batch_size=8)
+    assert stats["updated"] == len(logged_items)
+    assert LoggedItem.objects(food_name__exists=False).count() == 0
+    QUERY_COUNTER.reset()
+    with mock.patch.object(HTTP_CLIENT, "get") as mock_get:
+        # Simulate existing user
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.ok = True
+        resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}?from=01/01/2000")
+    assert resp.json is not None
+    assert resp.status_code == 200
+    returned: dict[str, dict] = {item["id"]: item for item in resp.json["logged_items"]}
+    for logged_item in logged_items:
+        assert returned[str(logged_item.pk)]["name"] in TEST_FOODS
+        assert returned[str(logged_item.pk)]["calories"] == pytest.approx(logged_item.quantity)
+    # History is read without fetching food items
+    assert FoodItem._get_collection_name() not in QUERY_COUNTER.queries
+    assert QUERY_COUNTER.queries.get(LoggedItem._get_collection_name()) == 1
+    # Rollups computed from snapshots match
+    rebuild_rollups()
+    assert verify_rollups() == []
+
+def test_user_items_paginated(client: FlaskClient, database: Database):
+    logged_items: list[LoggedItem] = create_logged_items(TEST_USER_ID, 20)
+    with mock.patch.object(HTTP_CLIENT, "get") as mock_get:
+        # Simulate existing user
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.ok = True
+        # Walk all pages
+        pages: list[list[str]] = []
+        cursor: str | None = None
+        while True:
+            resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}", query_string={"from": "01/01/2000", "limit": 6, **({"cursor": cursor} if cursor else {})})
+            assert resp.json is not None
+            assert resp.status_code == 200
+            pages.append([item["id"] for item in resp.json["logged_items"]])
+            cursor = resp.json["next_cursor"]
+            if cursor is None:
+                break
+        assert [len(page) for page in pages] == [6, 6, 6, 2]
+        # Items are returned oldest first, each exactly once
+        assert sum(pages, []) == [str(logged_item.pk) for logged_item in reversed(logged_items)]
+        # Streamed items match
+        resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}?from=01/01/2000&format=ndjson")
+        assert resp.status_code == 200
+        assert resp.mimetype == "application/x-ndjson"
+        assert [json.loads(line)["id"] for line in resp.data.decode().splitlines()] == sum(pages, [])
+        # Invalid cursor
+        resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}?cursor=invalid")
+        assert resp.status_code == 400
+
+def test_user_existence_cached(client: FlaskClient, database: Database):
+    with mock.patch.object(HTTP_CLIENT, "get") as mock_get:
+        # Simulate existing user
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.ok = True
+        # Only the first request checks whether the user exists
+        for _ in range(3):
+            resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}")
+            assert resp.status_code == 200
+        assert mock_get.call_count == 1
+        # Deleting user's items (part of user deletion) forgets the user
+        resp = client.delete(f"/api/v1/logged_item/user/{TEST_USER_ID}")
+        assert resp.status_code == 200
+        mock_get.return_value.status_code = 404
+        mock_get.return_value.ok = False
+        resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}")
+        assert resp.status_code == 400
+        assert mock_get.call_count == 2
+
+def test_indexes_used(database: Database):
+    LoggedItem.ensure_indexes()
+    logged_items: list[LoggedItem] = create_logged_items(TEST_USER_ID, 3)
+    # History of a user within a date range
+    assert_no_collscan(LoggedItem.objects(user_id=TEST_USER_ID, timestamp__gte=0.0, timestamp__lte=logged_items[0].timestamp).explain())
+    # Next page of history
+    assert_no_collscan(query_logged_items(TEST_USER_ID, datetime.date(2000, 1, 1), datetime.date.today(), encode_cursor(logged_items[1])).limit(10).explain())
+    # Deletion of all user's items
+    assert_no_collscan(LoggedItem.objects(user_id=TEST_USER_ID).explain())
+    # Daily rollups of a user within a date range
+    DailyRollup.ensure_indexes()
+    rebuild_rollups()
+    assert_no_collscan(DailyRollup.objects(user_id=TEST_USER_ID, day__gte="2000-01-01", day__lte="2100-01-01").explain())
+    # Food items of logged items
+    assert_no_collscan(FoodItem.objects(pk__in=[ObjectId(logged_item.food_item_id) for logged_item in logged_items]).explain())
+
+def test_user_totals(client: FlaskClient, database: Database):
+    # Log items on 20 consecutive days
+    logged_items: list[LoggedItem] = create_logged_items(TEST_USER_ID, 20)
+    rebuild_rollups()
+    with mock.patch.object(HTTP_CLIENT, "get") as mock_get:
+        # Simulate existing user
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.ok = True
+        # Daily totals
+        resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}/totals?from=01/01/2000&bucket=day")
+        assert resp.json is not None
+        assert resp.status_code == 200
+        totals = resp.json["totals"]
+        assert len(totals) == len(logged_items)
+        for total, logged_item in zip(totals, reversed(logged_items)):
+            assert total["start"] == datetime.date.fromtimestamp(logged_item.timestamp).strftime("%d/%m/%Y")
+            assert total["item_count"] == 1
+            assert total["calories"] == pytest.approx(logged_item.quantity)
+            assert total["protein"] == pytest.approx(logged_item.quantity * 0.02)
+        # Monthly totals add up to the same amounts
+        resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}/totals?from=01/01/2000&bucket=month")
+        assert resp.json is not None
+        assert resp.status_code == 200
+        assert sum(total["item_count"] for total in resp.json["totals"]) == len(logged_items)
+        assert sum(total["calories"] for total in resp.json["totals"]) == pytest.approx(sum(logged_item.quantity for logged_item in logged_items))
+        # Invalid bucket
+        resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}/totals?bucket=year")
+        assert resp.status_code == 400
+
+def test_rollup_day_far_from_utc():
+    # Noon in UTC+14 is still the previous day in UTC
+    tz: str | None = os.environ.get("TZ")
+    os.environ["TZ"] = "Pacific/Kiritimati"
+    time.tzset()
+    try:
+        timestamp: float = datetime.datetime(2025, 1, 10, 12, 0, 0).timestamp()
+        assert timestamp_to_day(timestamp) == datetime.date(2025, 1, 10)
+    finally:
+        if tz is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = tz
+        time.tzset()
+
+def test_rollups_maintained(client: FlaskClient, database: Database):
+    logged_items: list[LoggedItem] = create_logged_items(TEST_USER_ID, 5)
+    rebuild_rollups()
+    assert verify_rollups() == []
+    food_item: FoodItem = FoodItem.objects(pk=ObjectId(logged_items[0].food_item_id)).first()
+    # Simulate food_item and user_info microservices
+    def get(url: str, *args, **kwargs) -> mock.Mock:
+        response: mock.Mock = mock.Mock(status_code=200, ok=True)
+        response.content = json.dumps({"food_item": FoodItemConverter.to_dict(food_item)}).encode()
+        return response
+    with mock.patch.object(HTTP_CLIENT, "get", side_effect=get):
+        # Adding items updates rollups
+        for _ in range(2):
+            resp = client.post(f"/api/v1/logged_item/user/{TEST_USER_ID}", json={"food_name": food_item.name, "weight": 150.0})
+            assert resp.status_code == 200
+        assert verify_rollups() == []
+        today: str = datetime.date.today().strftime("%d/%m/%Y")
+        resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}/totals?from={today}&to={today}")
+        assert resp.json is not None
+        assert resp.json["totals"][0]["item_count"] == 3
+        assert resp.json["totals"][0]["weight_g"] == pytest.approx(logged_items[0].quantity + 300.0)
+    # Deleting items updates rollups
+    resp = client.delete(f"/api/v1/logged_item/{str(logged_items[1].pk)}")
+    assert resp.status_code == 200
+    assert verify_rollups() == []
+    assert DailyRollup.objects(user_id=TEST_USER_ID).count() == 4
+    # Deleting an item whose food item no longer exists (and has no snapshot) recomputes its day
+    FoodItem.objects(pk=ObjectId(logged_items[2].food_item_id)).delete()
+    resp = client.delete(f"/api/v1/logged_item/{str(logged_items[2].pk)}")
+    assert resp.status_code == 200
+    assert verify_rollups() == []
+    assert DailyRollup.objects(user_id=TEST_USER_ID).count() == 3
+    resp = client.delete(f"/api/v1/logged_item/user/{TEST_USER_ID}")
+    assert resp.status_code == 200
+    assert DailyRollup.objects(user_id=TEST_USER_ID).count() == 0
+
+def test_add_items_batch(client: FlaskClient, database: Database):
+    create_logged_items(TEST_USER_ID, 1)
+    food_item: FoodItem = FoodItem.objects(name=TEST_FOODS[0]).first()
+    rebuild_rollups()
+    # Simulate food_item (batch endpoint) and user_info microservices
+    food_response: mock.Mock = mock.Mock(status_code=200, ok=True)
+    food_response.content = json.dumps({"food_items": {
+        food_item.name: {"food_item": FoodItemConverter.to_dict(food_item), "status": 200},
+        "unknown": {"error": "The queried food \"unknown\" is unfortunately not available", "status": 404},
+    }}).encode()
+    with mock.patch.object(HTTP_CLIENT, "get") as mock_get, mock.patch.object(HTTP_CLIENT, "post", return_value=food_response) as mock_post:
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.ok = True
+        entries: list[dict[str, Any]] = [
+            {"food_name": food_item.name, "weight": 100.0},
+            {"food_name": "unknown", "weight": 50.0},
+            {"food_name": "", "weight": 50.0},
+            {"food_name": food_item.name.upper(), "weight": 200.0},
+        ]
+        resp = client.post(f"/api/v1/logged_item/user/{TEST_USER_ID}/batch", json={"items": entries})
+        # User and food items are each resolved with one request
+        assert mock_get.call_count == 1
+        assert mock_post.call_count == 1
+    assert resp.json is not None
+    assert resp.status_code == 200
+    assert [result["status"] for result in resp.json["results"]] == [200, 404, 400, 200]
+    for index in [0, 3]:
+        logged_item: LoggedItem | None = LoggedItem.objects(pk=ObjectId(resp.json["results"][index]["logged_item"]["id"])).first()
+        assert logged_item is not None
+        assert logged_item.quantity == entries[index]["weight"]
+    assert verify_rollups() == []
+
+def test_add_item_concurrent_calls(client: FlaskClient, database: Database):
+    create_logged_items(TEST_USER_ID, 1)
+    food_item: FoodItem = FoodItem.objects(name=TEST_FOODS[0]).first()
+    finished: list[str] = []
+    # Simulate slow food_item and user_info microservices
+    def get(url: str, *args, **kwargs) -> mock.Mock:
+        gevent.sleep(0.2 if "/user_info/" in url else 0.3)
+        finished.append(url)
+        response: mock.Mock = mock.Mock(status_code=200, ok=True)
+        if "/user_info/" in url and TEST_USER_ID not in url:
+            response.status_code = 404
+            response.ok = False
+        response.content = json.dumps({"food_item": FoodItemConverter.to_dict(food_item)}).encode()
+        return response
+    with mock.patch.object(HTTP_CLIENT, "get", side_effect=get):
+        # Both calls are made at the same time (sequential calls would take 0.5s)
+        time_start: float = time.time()
+        resp = client.post(f"/api/v1/logged_item/user/{TEST_USER_ID}", json={"food_name": food_item.name, "weight": 100.0})
+        assert resp.status_code == 200
+        assert time.time() - time_start < 0.45
+        # Food lookup is cancelled once the user turns out not to exist
+        finished.clear()
+        resp = client.post("/api/v1/logged_item/user/67793ecb4917570eb704a0ff", json={"food_name": food_item.name, "weight": 100.0})
+        assert resp.status_code == 404
+        assert not any("/food_item/" in url for url in finished)
+
+def test_add_item_in_process(client: FlaskClient, database: Database):
+    create_logged_items(TEST_USER_ID, 1)
+    food_item: FoodItem = FoodItem.objects(name=TEST_FOODS[0]).first()
+    user: UserInfo = UserInfo(username="janez")
+    user.save()
+    # Services share the process, so no HTTP requests are made
+    with mock.patch.object(service_clients, "FOOD_ITEM_CLIENT", service_clients.InProcessFoodItemClient()), \
+         mock.patch.object(service_clients, "USER_INFO_CLIENT", service_clients.InProcessUserInfoClient()), \
+         mock.patch.object(HTTP_CLIENT, "get") as mock_get, mock.patch.object(HTTP_CLIENT, "post") as mock_post:
+        resp = client.post(f"/api/v1/logged_item/user/{str(user.pk)}", json={"food_name": food_item.name, "weight": 100.0})
+        assert resp.json is not None
+        assert resp.status_code == 200
+        assert resp.json["logged_item"]["food_item_id"] == str(food_item.pk)
+        resp = client.post(f"/api/v1/logged_item/user/{str(user.pk)}/batch", json={"items": [{"food_name": food_item.name, "weight": 50.0}]})
+        assert resp.json is not None
+        assert resp.json["results"][0]["status"] == 200
+        # Unknown user
+        resp = client.post(f"/api/v1/logged_item/user/{TEST_USER_ID}", json={"food_name": food_item.name, "weight": 100.0})
+        assert resp.status_code == 404
+        assert not mock_get.called
+        assert not mock_post.called
+
+def test_user_remaining(client: FlaskClient, database: Database):
+    logged_items: list[LoggedItem] = create_logged_items(TEST_USER_ID, 3)
+    rebuild_rollups()
+    daily_rda: dict[str, float] = {"bmr": 1648.75, "tdee": 2555.5625, "calories": 2555.5625, "fat_total": 85, "fat_saturated": 28, "carbohydrates": 287, "fiber": 35, "sugar": 38, "protein": 159, "potassium": 3400, "sodium": 2300, "cholesterol": 300}
+    # Simulate user_info microservice
+    def get(url: str, *args, **kwargs) -> mock.Mock:
+        response: mock.Mock = mock.Mock(status_code=200, ok=True)
+        if TEST_USER_ID not in url:
+            response.status_code = 404
+            response.ok = False
+        response.content = json.dumps(daily_rda).encode()
+        return response
+    with mock.patch.object(HTTP_CLIENT, "get", side_effect=get) as mock_get:
+        resp = client.get(f"/api/v1/logged_item/user/{TEST_USER_ID}/remaining")
+        assert resp.json is not None
+        assert resp.status_code == 200
+        # Only today's item is consumed today
+        nutrients: dict[str, dict[str, float]] = resp.json["nutrients"]
+        assert nutrients["calories"]["consumed"] == pytest.approx(logged_items[0].quantity)
+        assert nutrients["calories"]["target"] == pytest.approx(daily_rda["calories"])
+        assert nutrients["calories"]["remaining"] == pytest.approx(daily_rda["calories"] - logged_items[0].quantity)
+        assert nutrients["protein"]["remaining"] == pytest.approx(daily_rda["protein"] - logged_items[0].quantity * 0.02)
+        # RDA request also checks that the user exists
+        assert mock_get.call_count == 1
+        resp = client.get("/api/v1/logged_item/user/67793ecb4917570eb704a0ff/remaining")
+        assert resp.status_code == 404
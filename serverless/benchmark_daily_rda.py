@@ -0,0 +1,37 @@
+from typing import Any
+from serverless.get_daily_rda import ActivityLevel, Gender, main
+from serverless.get_daily_rda_batch import compute_batch
+import argparse
+import random
+import time
+
+def random_profiles(count: int, seed: int) -> list[dict[str, Any]]:
+    generator: random.Random = random.Random(seed)
+    return [
+        {
+            "age": generator.randint(18, 90),
+            "height": round(generator.uniform(140.0, 210.0), 1),
+            "weight": round(generator.uniform(40.0, 150.0), 1),
+            "gender": generator.choice(list(Gender)).value,
+            "activity_level": generator.choice(list(ActivityLevel)).value,
+        }
+        for _ in range(count)
+    ]
+
+if __name__ == "__main__":
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Compare scalar and batch daily RDA calculation")
+    parser.add_argument("--count", type=int, default=10000, help="Number of random profiles")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of random profiles")
+    args: argparse.Namespace = parser.parse_args()
+
+    profiles: list[dict[str, Any]] = random_profiles(args.count, args.seed)
+    time_start: float = time.perf_counter()
+    scalar: list[dict[str, Any]] = [main(profile) for profile in profiles]
+    time_scalar: float = time.perf_counter() - time_start
+    time_start = time.perf_counter()
+    batch: list[dict[str, Any]] = compute_batch(profiles)
+    time_batch: float = time.perf_counter() - time_start
+    mismatches: int = sum(1 for expected, actual in zip(scalar, batch) if expected != actual)
+    print(f"Profiles: {args.count}, mismatches: {mismatches}")
+    print(f"Scalar: {time_scalar * 1000:.1f}ms ({time_scalar / args.count * 1e6:.2f}us per profile)")
+    print(f"Batch:  {time_batch * 1000:.1f}ms ({time_batch / args.count * 1e6:.2f}us per profile), {time_scalar / time_batch:.1f}x faster")
@@ -0,0 +1,103 @@
+from typing import Any
+import numpy as np
+from serverless.get_daily_rda import MACRO_SPLIT, ActivityLevel, Gender, get_activity_level, get_bmr, get_gender, get_tdee
+
+# Gender's constant term of BMR and activity level's TDEE multiplier by argument value, taken from the scalar formulas
+BMR_OFFSETS: dict[str, float] = {gender.value: get_bmr(0.0, 0.0, 0, gender) for gender in Gender}
+TDEE_MULTIPLIERS: dict[str, float] = {activity_level.value: get_tdee(1.0, activity_level) for activity_level in ActivityLevel}
+# Larger values cannot be converted to (exact) integers
+MAX_ABS_TDEE: float = 2.0 ** 53
+OUT_OF_RANGE_ERROR: str = "Invalid argument: height, weight and age must be finite numbers in a realistic range"
+RESULT_KEYS: list[str] = ["bmr", "tdee", "calories", "fat_total", "fat_saturated", "carbohydrates", "fiber", "sugar", "protein", "sodium", "potassium", "cholesterol"]
+
+def profile_error(args: dict[str, Any]) -> str:
+    # Error message of an invalid profile (slow path, same messages as the scalar function where it has them)
+    try:
+        float(args["height"])
+        float(args["weight"])
+        int(args["age"])
+        get_gender(args)
+        get_activity_level(args)
+    except KeyError as e:
+        return f"Missing argument: {e.args[0]}"
+    except (TypeError, ValueError) as e:
+        return f"Invalid argument: {str(e)}"
+    except Exception as e:
+        return str(e)
+    return "Invalid profile"
+
+def compute_batch(profiles: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    # Same results as get_daily_rda.main for each profile (in order), computed with array operations over all valid profiles
+    results: list[dict[str, Any]] = [{} for _ in profiles]
+    valid: list[int] = []
+    rows: list[tuple[float, float, int, float, float]] = []
+    for index, args in enumerate(profiles):
+        try:
+            rows.append((float(args["height"]), float(args["weight"]), int(args["age"]), BMR_OFFSETS[args["gender"]], TDEE_MULTIPLIERS[args["activity_level"]]))
+            valid.append(index)
+        except Exception:
+            results[index] = {"error": profile_error(args)}
+    if not valid:
+        return results
+    height, weight, age, bmr_offset, tdee_multiplier = np.array(rows, dtype=np.float64).T
+
+    # BMR and TDEE (operations in the same order as the scalar formulas, so results are identical)
+    with np.errstate(over="ignore", invalid="ignore"):
+        bmr: np.ndarray = 10.0 * weight + 6.25 * height - 5 * age + bmr_offset
+        tdee: np.ndarray = bmr * tdee_multiplier
+
+    # Non-finite profiles (e.g. "nan" or "inf" height) would otherwise turn into garbage integers below
+    in_range: np.ndarray = np.isfinite(tdee) & (np.abs(tdee) < MAX_ABS_TDEE)
+    if not in_range.all():
+        for index in np.flatnonzero(~in_range).tolist():
+            results[valid[index]] = {"error": OUT_OF_RANGE_ERROR}
+        valid = [index for index, ok in zip(valid, in_range.tolist()) if ok]
+        if not valid:
+            return results
+        bmr, tdee, bmr_offset = bmr[in_range], tdee[in_range], bmr_offset[in_range]
+
+    # Daily RDA of macros (in grams)
+    fat_calories: np.ndarray = tdee * MACRO_SPLIT["fat"]
+    fat: np.ndarray = np.trunc(fat_calories / 9.0)
+    carbs_calories: np.ndarray = tdee * MACRO_SPLIT["carbs"]
+    carbs: np.ndarray = np.trunc(carbs_calories / 4.0)
+    protein_calories: np.ndarray = tdee * MACRO_SPLIT["protein"]
+    protein: np.ndarray = np.trunc(protein_calories / 4.0)
+
+    # Daily RDA of macro subcategories (in grams)
+    fat_saturated_calories: np.ndarray = np.minimum(fat_calories, tdee * 0.10)
+    fat_saturated: np.ndarray = np.trunc(fat_saturated_calories / 9.0)
+    fiber: np.ndarray = np.minimum(carbs, np.trunc(14.0 * (tdee / 1000.0)))
+    fiber_calories: np.ndarray = 4.0 * fiber
+    sugar_calories: np.ndarray = np.minimum(0.06 * tdee, carbs_calories - fiber_calories)
+    sugar: np.ndarray = np.trunc(sugar_calories / 4.0)
+
+    # Daily RDA of micronutrients (in milligrams)
+    potassium: np.ndarray = np.where(bmr_offset == BMR_OFFSETS[Gender.FEMALE.value], 2600, 3400)
+    count: int = len(valid)
+
+    # Columns in order of RESULT_KEYS
+    columns: list[list[Any]] = [
+        bmr.tolist(),
+        tdee.tolist(),
+        tdee.tolist(),
+        fat.astype(np.int64).tolist(),
+        fat_saturated.astype(np.int64).tolist(),
+        carbs.astype(np.int64).tolist(),
+        fiber.astype(np.int64).tolist(),
+        sugar.astype(np.int64).tolist(),
+        protein.astype(np.int64).tolist(),
+        [2300] * count,
+        potassium.tolist(),
+        [300] * count,
+    ]
+    for index, row in zip(valid, zip(*columns)):
+        results[index] = dict(zip(RESULT_KEYS, row))
+    return results
+
+def main(args):
+    # Serverless entry point, args: {"profiles": [{"age", "height", "weight", "gender", "activity_level"}, ...]}
+    profiles: Any = args.get("profiles")
+    if not isinstance(profiles, list):
+        return {"error": "Missing argument: profiles (list of profiles)"}
+    return {"results": compute_batch(profiles)}
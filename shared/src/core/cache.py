@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from typing import Generic, Hashable, TypeVar
+from prometheus_client import Counter
+import threading
+import time
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+CACHE_HIT_COUNT: Counter = Counter(
+    "cache_hit_count",
+    "In-process cache hit count",
+    ["cache"],
+)
+CACHE_MISS_COUNT: Counter = Counter(
+    "cache_miss_count",
+    "In-process cache miss count",
+    ["cache"],
+)
+CACHE_EVICTION_COUNT: Counter = Counter(
+    "cache_eviction_count",
+    "In-process cache eviction count (capacity or expiry)",
+    ["cache"],
+)
+
+class TTLCache(Generic[K, V]):
+    # Bounded LRU cache where every entry also expires after ttl seconds
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name: str = name
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            entry: tuple[float, V] | None = self._entries.get(key)
+            if entry is None:
+                CACHE_MISS_COUNT.labels(self.name).inc()
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                CACHE_EVICTION_COUNT.labels(self.name).inc()
+                CACHE_MISS_COUNT.labels(self.name).inc()
+                return None
+            self._entries.move_to_end(key)
+            CACHE_HIT_COUNT.labels(self.name).inc()
+            return value
+
+    def set(self, key: K, value: V):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                CACHE_EVICTION_COUNT.labels(self.name).inc()
+
+    def delete(self, key: K):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,104 @@
+from typing import Callable
+from prometheus_client import Gauge, Histogram
+import threading
+import time
+import gevent
+
+DEPENDENCY_CHECK_LATENCY: Histogram = Histogram(
+    "dependency_check_latency",
+    "Latency of readiness checks of a microservice's dependencies",
+    ["service", "dependency"],
+)
+DEPENDENCY_UP: Gauge = Gauge(
+    "dependency_up",
+    "Result of the latest readiness check of a microservice's dependency (1 = available)",
+    ["service", "dependency"],
+)
+
+class DependencyCheck():
+    def __init__(self, name: str, check: Callable[[], None], error_status: int, error_prefix: str, timeout: float):
+        self.name: str = name
+        self.check: Callable[[], None] = check
+        self.error_status: int = error_status
+        self.error_prefix: str = error_prefix
+        self.timeout: float = timeout
+        self.error: str | None = None
+        self.checked_at: float | None = None
+        self._result: str | None = None
+        self._thread: threading.Thread | None = None
+
+    def _run(self):
+        try:
+            self.check()
+            self._result = None
+        except Exception as e:
+            self._result = f"{self.error_prefix}{str(e)}"
+
+    def start(self):
+        # A check still hanging since an earlier refresh is not started again
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def finish(self, deadline: float):
+        if self._thread is not None:
+            self._thread.join(max(deadline - time.time(), 0.0))
+        if self._thread is not None and self._thread.is_alive():
+            self.error = f"{self.error_prefix}check timed out after {self.timeout}s"
+        else:
+            self.error = self._result
+
+class HealthMonitor():
+    # Runs dependency checks in a background greenlet, so probes only read the latest results
+    def __init__(self, service: str, interval: float, max_staleness: float, timeout: float):
+        self.service: str = service
+        self.interval: float = interval
+        self.max_staleness: float = max_staleness
+        self.timeout: float = timeout
+        self.checks: list[DependencyCheck] = []
+        self._greenlet: gevent.Greenlet | None = None
+        self._loop_refreshed: bool = False
+        self._lock: threading.Lock = threading.Lock()
+
+    def add_check(self, name: str, check: Callable[[], None], error_status: int, error_prefix: str = "", timeout: float | None = None):
+        # check() raises an exception if the dependency is not available
+        self.checks.append(DependencyCheck(name, check, error_status, error_prefix, timeout or self.timeout))
+
+    def refresh(self):
+        with self._lock:
+            # Checks run concurrently, each with its own timeout, so one hung dependency does not stall the others
+            time_start: float = time.time()
+            for dependency in self.checks:
+                dependency.start()
+            for dependency in self.checks:
+                dependency.finish(time_start + dependency.timeout)
+                dependency.checked_at = time.time()
+                DEPENDENCY_CHECK_LATENCY.labels(self.service, dependency.name).observe(dependency.checked_at - time_start)
+                DEPENDENCY_UP.labels(self.service, dependency.name).set(0 if dependency.error else 1)
+
+    def start(self):
+        # Only call this when gevent's hub gets to run (i.e. monkey patched WSGIServer), otherwise the loop never runs
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        while True:
+            self.refresh()
+            self._loop_refreshed = True
+            gevent.sleep(self.interval)
+
+    def is_stale(self) -> bool:
+        oldest: float = min((dependency.checked_at or 0.0 for dependency in self.checks), default=time.time())
+        return time.time() - oldest > self.max_staleness
+
+    def readiness(self) -> tuple[str, int] | None:
+        # Returns None if all dependencies are available, otherwise an error message and status code
+        if self.is_stale():
+            if self._greenlet is not None and self._loop_refreshed:
+                return f"Readiness checks of {self.service} are stale (older than {self.max_staleness}s)", 503
+            # Without a (running) background loop, e.g. development server, refresh on demand
+            self.refresh()
+        for dependency in self.checks:
+            if dependency.error is not None:
+                return dependency.error, dependency.error_status
+        return None
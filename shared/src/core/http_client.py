@@ -0,0 +1,76 @@
+from typing import Any
+from prometheus_client import Counter, Gauge, Histogram
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import requests
+import os
+import time
+
+load_dotenv()
+
+HTTP_CLIENT_LATENCY: Histogram = Histogram(
+    "http_client_latency",
+    "Latency of outbound HTTP requests, per destination",
+    ["destination", "method"],
+)
+HTTP_CLIENT_ERROR_COUNT: Counter = Counter(
+    "http_client_error_count",
+    "Outbound HTTP requests that failed (exception type) or returned a server error (5xx), per destination",
+    ["destination", "error"],
+)
+HTTP_CLIENT_IN_FLIGHT: Gauge = Gauge(
+    "http_client_in_flight",
+    "Outbound HTTP requests in progress (connections taken from the pool), per destination",
+    ["destination"],
+)
+HTTP_CLIENT_POOL_SIZE: Gauge = Gauge(
+    "http_client_pool_size",
+    "Max number of kept-alive connections per host (in_flight above this means the pool is saturated)",
+    ["destination"],
+)
+
+class HttpClient():
+    # One session shared by all outbound calls: connections are kept alive and pooled per host,
+    # and every request gets default timeouts and metrics labelled with its destination
+    def __init__(self, pool_connections: int, pool_maxsize: int, connect_timeout: float, read_timeout: float):
+        self.pool_maxsize: int = pool_maxsize
+        self.timeout: tuple[float, float] = (connect_timeout, read_timeout)
+        self.session: requests.Session = requests.Session()
+        # Requests beyond pool_maxsize open extra connections (closed afterwards) instead of waiting for a free one
+        adapter: HTTPAdapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=False)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method: str, url: str, destination: str, **kwargs: Any) -> requests.Response:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        HTTP_CLIENT_POOL_SIZE.labels(destination).set(self.pool_maxsize)
+        HTTP_CLIENT_IN_FLIGHT.labels(destination).inc()
+        time_start: float = time.time()
+        try:
+            response: requests.Response = self.session.request(method, url, **kwargs)
+            if response.status_code >= 500:
+                HTTP_CLIENT_ERROR_COUNT.labels(destination, str(response.status_code)).inc()
+            return response
+        except Exception as e:
+            HTTP_CLIENT_ERROR_COUNT.labels(destination, type(e).__name__).inc()
+            raise
+        finally:
+            HTTP_CLIENT_IN_FLIGHT.labels(destination).dec()
+            HTTP_CLIENT_LATENCY.labels(destination, method).observe(time.time() - time_start)
+
+    def get(self, url: str, destination: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, destination, **kwargs)
+
+    def post(self, url: str, destination: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, destination, **kwargs)
+
+    def delete(self, url: str, destination: str, **kwargs: Any) -> requests.Response:
+        return self.request("DELETE", url, destination, **kwargs)
+
+HTTP_CLIENT: HttpClient = HttpClient(
+    pool_connections=int(os.environ.get("HTTP_CLIENT_POOL_CONNECTIONS", 10)),
+    pool_maxsize=int(os.environ.get("HTTP_CLIENT_POOL_SIZE", 50)),
+    connect_timeout=float(os.environ.get("HTTP_CLIENT_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.environ.get("HTTP_CLIENT_READ_TIMEOUT", 30)),
+)
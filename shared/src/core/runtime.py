@@ -0,0 +1,11 @@
+from gevent import monkey
+import os
+
+def is_production() -> bool:
+    return os.environ.get("ENVIRONMENT", "development").lower() in ["prod", "production"]
+
+def patch_for_production():
+    # Must run before anything else is imported by the entrypoint
+    if is_production():
+        # Make blocking IO (sockets, locks, sleeps) cooperative under gevent's WSGIServer
+        monkey.patch_all()
@@ -0,0 +1,63 @@
+from typing import Callable, Generic, Hashable, TypeVar, cast
+from prometheus_client import Counter
+import threading
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+SINGLE_FLIGHT_SHARED_COUNT: Counter = Counter(
+    "single_flight_shared_count",
+    "Number of callers that waited for an already in-flight call instead of making their own",
+    ["group"],
+)
+
+class _Call(Generic[V]):
+    def __init__(self):
+        self.done: threading.Event = threading.Event()
+        self.result: V | None = None
+        self.error: Exception | None = None
+        # Set if the leader was cancelled (e.g. its greenlet was killed) before fn finished
+        self.abandoned: bool = False
+
+class SingleFlight(Generic[K, V]):
+    # Concurrent calls with the same key share one execution of the function and its result
+    # (threading primitives become cooperative once gevent's monkey patching is applied)
+    def __init__(self, name: str):
+        self.name: str = name
+        self._calls: dict[K, _Call[V]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def do(self, key: K, fn: Callable[[], V]) -> V:
+        while True:
+            with self._lock:
+                call: _Call[V] | None = self._calls.get(key)
+                leader: bool = call is None
+                if call is None:
+                    call = _Call()
+                    self._calls[key] = call
+            if leader:
+                return self._lead(key, call, fn)
+            SINGLE_FLIGHT_SHARED_COUNT.labels(self.name).inc()
+            call.done.wait()
+            if call.abandoned:
+                # The leader's cancellation is not ours, so one of the waiters makes the call instead
+                continue
+            if call.error is not None:
+                raise call.error
+            return cast(V, call.result)
+
+    def _lead(self, key: K, call: _Call[V], fn: Callable[[], V]) -> V:
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            # GreenletExit, KeyboardInterrupt, ...: only the cancelled caller gets it
+            call.abandoned = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
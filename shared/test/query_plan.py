@@ -0,0 +1,15 @@
+from typing import Any
+
+def plan_stages(plan: dict[str, Any]) -> list[str]:
+    # Flatten the stages of a (winning) query plan
+    stages: list[str] = [plan.get("stage", "")]
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages += plan_stages(child)
+    return stages
+
+def assert_no_collscan(explanation: dict[str, Any]):
+    winning_plan: dict[str, Any] = explanation["queryPlanner"]["winningPlan"]
+    # Plans executed by the slot based engine are nested one level deeper
+    stages: list[str] = plan_stages(winning_plan.get("queryPlan", winning_plan))
+    assert "COLLSCAN" not in stages, stages
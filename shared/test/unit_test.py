@@ -0,0 +1,173 @@
+from typing import Any
+from prometheus_client import REGISTRY
+from shared.src.core.health import HealthMonitor
+from shared.src.core.single_flight import SingleFlight
+from shared.test.query_plan import assert_no_collscan, plan_stages
+import gevent
+import gevent.event
+import pytest
+import threading
+import time
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline: float = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Condition not met in time"
+        time.sleep(0.01)
+
+def shared_count(name: str) -> float:
+    return REGISTRY.get_sample_value("single_flight_shared_count_total", {"group": name}) or 0.0
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights: SingleFlight[str, int] = SingleFlight(name="test_coalesce")
+    release: threading.Event = threading.Event()
+    upstream_calls: list[str] = []
+    results: list[int] = []
+
+    def fetch() -> int:
+        # Slow upstream call, blocked until every caller is waiting for it
+        upstream_calls.append("apple")
+        release.wait()
+        return 42
+
+    threads: list[threading.Thread] = [
+        threading.Thread(target=lambda: results.append(flights.do("apple", fetch)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    # One caller executes fetch, the other four wait for its result
+    wait_for(lambda: shared_count("test_coalesce") == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert upstream_calls == ["apple"]
+    assert results == [42] * 5
+    # Once the call is done, the next miss triggers a new call
+    assert flights.do("apple", fetch) == 42
+    assert len(upstream_calls) == 2
+
+def test_single_flight_shares_errors():
+    flights: SingleFlight[str, int] = SingleFlight(name="test_errors")
+    release: threading.Event = threading.Event()
+    errors: list[Exception] = []
+
+    def fetch() -> int:
+        release.wait()
+        raise ValueError("upstream failed")
+
+    def call():
+        try:
+            flights.do("apple", fetch)
+        except ValueError as e:
+            errors.append(e)
+
+    threads: list[threading.Thread] = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: shared_count("test_errors") == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3
+    # Different keys do not wait for each other
+    assert flights.do("banana", lambda: 1) == 1
+
+def test_single_flight_leader_cancelled():
+    flights: SingleFlight[str, int] = SingleFlight(name="test_cancelled")
+    started: gevent.event.Event = gevent.event.Event()
+    release: gevent.event.Event = gevent.event.Event()
+    upstream_calls: list[str] = []
+
+    def fetch() -> int:
+        upstream_calls.append("apple")
+        started.set()
+        release.wait()
+        return 42
+
+    leader: gevent.Greenlet = gevent.spawn(flights.do, "apple", fetch)
+    started.wait()
+    waiter: gevent.Greenlet = gevent.spawn(flights.do, "apple", fetch)
+    gevent.sleep(0)
+    assert shared_count("test_cancelled") == 1
+    # Killing the leader (e.g. a request that gave up) must not fail the waiter, which retries as the new leader
+    leader.kill()
+    release.set()
+    assert waiter.get(timeout=5) == 42
+    assert len(upstream_calls) == 2
+    assert flights._calls == {}
+
+def test_readiness_without_loop():
+    monitor: HealthMonitor = HealthMonitor(service="test", interval=10, max_staleness=30, timeout=1)
+    calls: list[str] = []
+    failing: list[bool] = [False]
+
+    def check():
+        calls.append("database")
+        if failing[0]:
+            raise ConnectionError("refused")
+
+    monitor.add_check("database", check, 503, "Database not available: ")
+    # Checks run on demand when there is no background loop
+    assert monitor.readiness() is None
+    assert monitor.readiness() is None
+    assert calls == ["database"]
+    # Started, but the hub never ran the loop (development server): still refreshed on demand
+    monitor.start()
+    try:
+        failing[0] = True
+        monitor.max_staleness = 0
+        assert monitor.readiness() == ("Database not available: refused", 503)
+        assert len(calls) == 2
+    finally:
+        gevent.kill(monitor._greenlet)
+
+def test_readiness_with_loop():
+    monitor: HealthMonitor = HealthMonitor(service="test", interval=10, max_staleness=30, timeout=1)
+    calls: list[str] = []
+    monitor.add_check("database", lambda: calls.append("database"), 503)
+    monitor.start()
+    try:
+        # Let the loop run its first refresh
+        for _ in range(100):
+            if monitor._loop_refreshed:
+                break
+            gevent.sleep(0.01)
+        assert monitor._loop_refreshed
+        assert monitor.readiness() is None
+        assert calls == ["database"]
+        # Probes do not run checks themselves while the loop is responsible for them
+        monitor.max_staleness = 0
+        error: tuple[str, int] | None = monitor.readiness()
+        assert error is not None and error[1] == 503 and "stale" in error[0]
+        assert calls == ["database"]
+    finally:
+        gevent.kill(monitor._greenlet)
+
+def test_readiness_check_timeout():
+    monitor: HealthMonitor = HealthMonitor(service="test", interval=10, max_staleness=30, timeout=5)
+    release: threading.Event = threading.Event()
+
+    def hang():
+        release.wait()
+
+    monitor.add_check("database", lambda: None, 503)
+    monitor.add_check("calorie_ninjas_api", hang, 504, timeout=0.1)
+    time_start: float = time.time()
+    try:
+        # A hung dependency fails after its own timeout instead of stalling every check
+        assert monitor.readiness() == ("check timed out after 0.1s", 504)
+        assert time.time() - time_start < 1
+        assert monitor.checks[0].error is None
+    finally:
+        release.set()
+
+def test_query_plan_stages():
+    index_plan: dict[str, Any] = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}
+    or_plan: dict[str, Any] = {"stage": "SUBPLAN", "inputStage": {"stage": "OR", "inputStages": [index_plan, {"stage": "COLLSCAN"}]}}
+    assert plan_stages(or_plan) == ["SUBPLAN", "OR", "FETCH", "IXSCAN", "COLLSCAN"]
+    # Classic and slot based engine explanations
+    assert_no_collscan({"queryPlanner": {"winningPlan": index_plan}})
+    assert_no_collscan({"queryPlanner": {"winningPlan": {"queryPlan": index_plan}}})
+    with pytest.raises(AssertionError):
+        assert_no_collscan({"queryPlanner": {"winningPlan": {"queryPlan": or_plan}}})
@@ -4,6 +4,7 @@ from werkzeug.test import TestResponse
 from food_item.src.api.v1.api import app as app_food_item
 from logged_item.src.api.v1.api import app as app_logged_item
 from user_info.src.api.v1.api import app as app_user_info
+from food_item.src.core.manage_food_item import FOOD_ITEM_CACHE, FOOD_NAME_INDEX, UNKNOWN_FOOD_CACHE
 import pytest
 from pymongo.synchronous.database import Database
 from pymongo.synchronous.mongo_client import MongoClient
@@ -82,6 +83,10 @@ def database():
     # Clear test DB
     for collection in db.list_collection_names():
         db.drop_collection(collection)
+    # Clear in-process caches (they may hold documents from the dropped DB)
+    FOOD_ITEM_CACHE.clear()
+    UNKNOWN_FOOD_CACHE.clear()
+    FOOD_NAME_INDEX.clear()
     # Run test
     yield db
     # Disconnect from DB
@@ -1,3 +1,5 @@
+from shared.src.core.runtime import is_production, patch_for_production
+patch_for_production()
 import os
 from typing import Any, cast
 from flask import Response, jsonify, request
@@ -5,8 +7,8 @@ from flask_cors import CORS
 from gevent.pywsgi import WSGIServer
 from mongoengine import connect, get_connection
 from dotenv import load_dotenv
-from user_info.src.core.daily_rda import get_daily_rda
-from user_info.src.core.manage_user_info import check_serverless, create_user, delete_user, get_user_info, get_user_info_by_username
+from user_info.src.core.daily_rda import get_daily_rda, get_daily_rda_batch, uses_serverless
+from user_info.src.core.manage_user_info import check_serverless, create_user, delete_user, get_user_info, get_user_info_by_username, get_user_infos
 from user_info.src.models.converters.user_info_converter import UserInfoConverter
 from user_info.src.models.entities.user_info import UserInfo
 from flask_openapi3.openapi import OpenAPI
@@ -15,9 +17,12 @@ from flask_openapi3.models.tag import Tag
 from pydantic import BaseModel, Field
 from prometheus_client import make_wsgi_app, Counter, Histogram
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from shared.src.core.health import HealthMonitor
 import time
 
 load_dotenv()
+RDA_BATCH_MAX_USERS: int = int(os.environ.get("RDA_BATCH_MAX_USERS", 10000))
+USER_BATCH_MAX: int = int(os.environ.get("USER_INFO_BATCH_MAX", 1000))
 connect(
     db=os.environ["MONGO_DB_NAME"],
     host=os.environ["MONGO_HOST"],
@@ -77,6 +82,40 @@ class DailyRdaPydantic(BaseModel):
     sodium: int = Field(2300, description="Daily sodium allowance, in milligrams")
     cholesterol: int = Field(300, description="Daily cholesterol allowance, in milligrams")
 
+class UserInfoResultPydantic(BaseModel):
+    status: int = Field(200, description="Status code of this id or username")
+    user_info: UserInfoPydantic | None = Field(None, description="User (if status is 200)")
+    error: str | None = Field(None, description="Error message (if status is not 200)")
+
+class UserInfoBatchQuery(BaseModel):
+    ids: str | None = Field(None, description="Comma separated ids of users")
+    usernames: str | None = Field(None, description="Comma separated usernames")
+
+class UserInfoBatchBody(BaseModel):
+    ids: list[str] = Field([], description="Ids of users")
+    usernames: list[str] = Field([], description="Usernames")
+
+class UserInfoBatchResponse(BaseModel):
+    ids: dict[str, UserInfoResultPydantic] = Field(..., description="Result of each requested id")
+    usernames: dict[str, UserInfoResultPydantic] = Field(..., description="Result of each requested username")
+
+class UserInfoBatchResponseError(BaseModel):
+    error: str = Field("Too many users: ...", description="Error message")
+
+class DailyRdaResultPydantic(BaseModel):
+    status: int = Field(200, description="Status code of this user id")
+    daily_rda: DailyRdaPydantic | None = Field(None, description="User's daily RDA values (if status is 200)")
+    error: str | None = Field(None, description="Error message (if status is not 200)")
+
+class DailyRdaBatchBody(BaseModel):
+    ids: list[str] = Field(..., description="Ids of users")
+
+class DailyRdaBatchResponse(BaseModel):
+    daily_rda: dict[str, DailyRdaResultPydantic] = Field(..., description="Result of each requested user id")
+
+class DailyRdaBatchResponseError(BaseModel):
+    error: str = Field("Too many users: ...", description="Error message")
+
 class LivenessResponse(BaseModel):
     message: str = Field("Liveness probe successful", description="Success message")
 
@@ -106,6 +145,16 @@ REQ_LATENCY: Histogram = Histogram(
     ["method", "endpoint"],
 )
 
+HEALTH_MONITOR: HealthMonitor = HealthMonitor(
+    service="user_info",
+    interval=float(os.environ.get("HEALTH_CHECK_INTERVAL", 10)),
+    max_staleness=float(os.environ.get("HEALTH_CHECK_MAX_STALENESS", 30)),
+    timeout=float(os.environ.get("HEALTH_CHECK_TIMEOUT", 5)),
+)
+HEALTH_MONITOR.add_check("database", lambda: get_connection().server_info(), 503, "Database not available: ")
+if uses_serverless():
+    HEALTH_MONITOR.add_check("serverless", check_serverless, 504)
+
 @app.get(
     "/api/v1/",
     responses={
@@ -206,6 +255,43 @@ def user_info_by_username(path: UsernamePath):
     REQ_LATENCY.labels("GET", "/api/v1/user_info/username/<string:username>").observe(time.time() - time_start)
     return response
 
+def user_info_batch(method: str, ids: list[str], usernames: list[str]) -> tuple[Response, int]:
+    time_start: float = time.time()
+    response: tuple[Response, int] = jsonify({}), 0
+    if len(ids) + len(usernames) > USER_BATCH_MAX:
+        response = jsonify({"error": f"Too many users: {len(ids) + len(usernames)} (max {USER_BATCH_MAX})"}), 400
+    else:
+        response = jsonify(get_user_infos(ids, usernames)), 200
+    REQ_COUNT.labels(method, "/api/v1/user_info/batch", response[1]).inc()
+    REQ_LATENCY.labels(method, "/api/v1/user_info/batch").observe(time.time() - time_start)
+    return response
+
+@app.get(
+    "/api/v1/user_info/batch",
+    tags=[TAG_USER],
+    summary="Get many users by ids and/or usernames at once",
+    responses={
+        200: UserInfoBatchResponse,
+        400: UserInfoBatchResponseError,
+    },
+)
+def get_user_batch(query: UserInfoBatchQuery):
+    ids: list[str] = [id.strip() for id in (query.ids or "").split(",") if id.strip()]
+    usernames: list[str] = [username.strip() for username in (query.usernames or "").split(",") if username.strip()]
+    return user_info_batch("GET", ids, usernames)
+
+@app.post(
+    "/api/v1/user_info/batch",
+    tags=[TAG_USER],
+    summary="Get many users by ids and/or usernames at once",
+    responses={
+        200: UserInfoBatchResponse,
+        400: UserInfoBatchResponseError,
+    },
+)
+def post_user_batch(body: UserInfoBatchBody):
+    return user_info_batch("POST", body.ids, body.usernames)
+
 @app.get(
     "/api/v1/user_info/daily_rda/<string:id>",
     tags=[TAG_RDA],
@@ -228,6 +314,26 @@ def daily_rda_for_user(path: UserIdPath):
     REQ_LATENCY.labels("GET", "/api/v1/user_info/daily_rda/<string:id>").observe(time.time() - time_start)
     return response
 
+@app.post(
+    "/api/v1/user_info/daily_rda/batch",
+    tags=[TAG_RDA],
+    summary="Get daily RDA values of many users at once",
+    responses={
+        200: DailyRdaBatchResponse,
+        400: DailyRdaBatchResponseError,
+    },
+)
+def daily_rda_batch(body: DailyRdaBatchBody):
+    time_start: float = time.time()
+    response: tuple[Response, int] = jsonify({}), 0
+    if len(body.ids) > RDA_BATCH_MAX_USERS:
+        response = jsonify({"error": f"Too many users: {len(body.ids)} (max {RDA_BATCH_MAX_USERS})"}), 400
+    else:
+        response = jsonify({"daily_rda": get_daily_rda_batch(body.ids)}), 200
+    REQ_COUNT.labels("POST", "/api/v1/user_info/daily_rda/batch", response[1]).inc()
+    REQ_LATENCY.labels("POST", "/api/v1/user_info/daily_rda/batch").observe(time.time() - time_start)
+    return response
+
 @app.get(
     "/api/v1/user_info/health/live",
     tags=[TAG_HEALTH],
@@ -250,24 +356,25 @@ def user_info_liveness_probe():
     },
 )
 def user_info_readiness_probe():
-    # Check database availability
-    try:
-        get_connection().server_info()
-    except Exception as e:
-        return jsonify({"error": f"Database not available: {str(e)}"}), 503
-    # Check serverless functions availability
-    try:
-        check_serverless()
-    except Exception as e:
-        return jsonify({"error": str(e)}), 504
+    # Check database and serverless functions availability (results of background checks)
+    error: tuple[str, int] | None = HEALTH_MONITOR.readiness()
+    if error is not None:
+        return jsonify({"error": error[0]}), error[1]
     return jsonify({"message": "Readiness probe successful"}), 200
 
+def startup():
+    # Make sure that all collections are indexed
+    UserInfo.ensure_indexes()
+    # Background health checks need gevent's hub, which only runs under the patched WSGIServer
+    if is_production():
+        HEALTH_MONITOR.start()
+
 if __name__ == "__main__":
-    environment: str = os.environ.get("ENVIRONMENT", "development").lower()
+    startup()
     debug: bool = (os.environ.get("FLASK_DEBUG", "True").lower() != "false")
     host: str = os.environ.get("FLASK_HOST", "0.0.0.0")
     port: int = int(os.environ.get("FLASK_PORT", 5000))
-    if environment in ["prod", "production"]:
+    if is_production():
         http_server = WSGIServer((host, port), app)
         http_server.serve_forever()
     else:
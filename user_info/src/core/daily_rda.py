@@ -1,28 +1,179 @@
 import os
+from abc import ABC, abstractmethod
 from typing import Any
 import requests
+from dotenv import load_dotenv
+from prometheus_client import Counter, Histogram
+from serverless.get_daily_rda import main as compute_daily_rda
+from serverless.get_daily_rda_batch import compute_batch
+from bson import ObjectId
+from bson.errors import InvalidId
+from shared.src.core.http_client import HTTP_CLIENT
 from user_info.src.models.entities.user_info import UserInfo
+import gevent
+import hashlib
 import json
+import time
 
-def get_daily_rda(user: UserInfo) -> dict[str, Any]:
-    url: str = f"{os.environ['SERVERLESS_NAMESPACE_URL']}/actions/get_daily_rda"
-    params: dict[str, Any] = {
-        "blocking": True,
-        "result": True,
-    }
-    headers: dict[str, Any] = {
-        "Content-Type": "application/json",
-        "Authorization": f"Basic {os.environ['SERVERLESS_AUTH']}",
-    }
-    data: dict[str, Any] = {
+RDA_BACKENDS: list[str] = ["local", "serverless", "serverless_with_fallback"]
+RDA_PROFILE_FIELDS: list[str] = ["age", "height", "weight", "gender", "activity_level"]
+
+load_dotenv()
+
+RDA_LATENCY: Histogram = Histogram(
+    "user_info_rda_latency",
+    "Latency of daily RDA calculations, per backend",
+    ["backend"],
+)
+RDA_ERROR_COUNT: Counter = Counter(
+    "user_info_rda_error_count",
+    "Failed daily RDA calculations, per backend",
+    ["backend"],
+)
+RDA_MEMO_COUNT: Counter = Counter(
+    "user_info_rda_memo_count",
+    "Daily RDA requests answered with the value memoized on the user (hit) or calculated (miss)",
+    ["result"],
+)
+RDA_FALLBACK_COUNT: Counter = Counter(
+    "user_info_rda_fallback_count",
+    "Daily RDA calculations that fell back to the local backend, per reason",
+    ["reason"],
+)
+
+def rda_arguments(user: UserInfo) -> dict[str, Any]:
+    return {
         "age": user.age,
         "height": user.height,
         "weight": user.weight,
         "gender": user.gender.value,
         "activity_level": user.activity_level.value,
     }
-    response: requests.Response = requests.post(url=url, params=params, headers=headers, data=json.dumps(data))
-    if not response.ok:
-        raise Exception(f"Failed to get daily RDA for user with id {str(user.pk)}: {response.status_code=}, {response.text=}")
-    return json.loads(response.text)
 
+class RdaBackend(ABC):
+    name: str = ""
+
+    def get(self, args: dict[str, Any]) -> dict[str, Any]:
+        time_start: float = time.time()
+        try:
+            return self.compute(args)
+        except Exception:
+            RDA_ERROR_COUNT.labels(self.name).inc()
+            raise
+        finally:
+            RDA_LATENCY.labels(self.name).observe(time.time() - time_start)
+
+    @abstractmethod
+    def compute(self, args: dict[str, Any]) -> dict[str, Any]:
+        # Raises an exception if daily RDA values could not be calculated
+        ...
+
+class LocalRdaBackend(RdaBackend):
+    # Runs the serverless function's code in process (pure computation, no IO)
+    name: str = "local"
+
+    def compute(self, args: dict[str, Any]) -> dict[str, Any]:
+        result: dict[str, Any] = compute_daily_rda(args)
+        if "error" in result:
+            raise Exception(f"Failed to get daily RDA: {result['error']}")
+        return result
+
+class ServerlessRdaBackend(RdaBackend):
+    name: str = "serverless"
+
+    def __init__(self, timeout: float | None = None):
+        # Deadline of the whole call (None means the shared HTTP client's default timeouts)
+        self.timeout: float | None = timeout
+
+    def compute(self, args: dict[str, Any]) -> dict[str, Any]:
+        url: str = f"{os.environ['SERVERLESS_NAMESPACE_URL']}/actions/get_daily_rda"
+        params: dict[str, Any] = {
+            "blocking": True,
+            "result": True,
+        }
+        headers: dict[str, Any] = {
+            "Content-Type": "application/json",
+            "Authorization": f"Basic {os.environ['SERVERLESS_AUTH']}",
+        }
+        # requests applies a plain timeout to connecting and to every read separately, so the total is enforced with
+        # gevent.Timeout (under the patched WSGIServer), while the per-phase timeout still bounds unpatched development runs
+        with gevent.Timeout(self.timeout, requests.exceptions.Timeout(f"Serverless function did not respond within {self.timeout}s")):
+            response: requests.Response = HTTP_CLIENT.post(url, "serverless", params=params, headers=headers, data=json.dumps(args), timeout=self.timeout)
+        if not response.ok:
+            raise Exception(f"Failed to get daily RDA: {response.status_code=}, {response.text=}")
+        return json.loads(response.text)
+
+class FallbackRdaBackend(RdaBackend):
+    # Asks the primary backend, and computes locally if it times out or fails (both run the same code)
+    name: str = "serverless_with_fallback"
+
+    def __init__(self, primary: RdaBackend, fallback: RdaBackend):
+        self.primary: RdaBackend = primary
+        self.fallback: RdaBackend = fallback
+
+    def compute(self, args: dict[str, Any]) -> dict[str, Any]:
+        try:
+            return self.primary.get(args)
+        except requests.exceptions.Timeout:
+            RDA_FALLBACK_COUNT.labels("timeout").inc()
+        except Exception:
+            RDA_FALLBACK_COUNT.labels("error").inc()
+        return self.fallback.get(args)
+
+def make_rda_backend(backend: str) -> RdaBackend:
+    if backend not in RDA_BACKENDS:
+        raise Exception(f"Invalid RDA backend: {backend}, allowed values: {RDA_BACKENDS}")
+    match backend:
+        case "serverless":
+            return ServerlessRdaBackend()
+        case "serverless_with_fallback":
+            return FallbackRdaBackend(ServerlessRdaBackend(float(os.environ.get("RDA_SERVERLESS_TIMEOUT", 2))), LocalRdaBackend())
+    return LocalRdaBackend()
+
+RDA_BACKEND: RdaBackend = make_rda_backend(os.environ.get("RDA_BACKEND", "local").lower())
+
+def uses_serverless() -> bool:
+    return not isinstance(RDA_BACKEND, LocalRdaBackend)
+
+def rda_fingerprint(args: dict[str, Any]) -> str:
+    # Changes whenever any of the fields that RDA depends on changes
+    return hashlib.sha256(json.dumps(args, sort_keys=True).encode("utf-8")).hexdigest()
+
+def get_daily_rda(user: UserInfo) -> dict[str, Any]:
+    args: dict[str, Any] = rda_arguments(user)
+    fingerprint: str = rda_fingerprint(args)
+    # Memoized value was read together with the user, so repeated requests need no calculation
+    if user.daily_rda and user.rda_fingerprint == fingerprint:
+        RDA_MEMO_COUNT.labels("hit").inc()
+        return user.daily_rda
+    RDA_MEMO_COUNT.labels("miss").inc()
+    try:
+        daily_rda: dict[str, Any] = RDA_BACKEND.get(args)
+    except Exception as e:
+        raise Exception(f"Failed to get daily RDA for user with id {str(user.pk)}: {str(e)}")
+    UserInfo.objects(pk=user.pk).update_one(set__rda_fingerprint=fingerprint, set__daily_rda=daily_rda)
+    user.rda_fingerprint = fingerprint
+    user.daily_rda = daily_rda
+    return daily_rda
+
+def get_daily_rda_batch(user_ids: list[str]) -> dict[str, dict[str, Any]]:
+    # Result of each user id (RDA or error, with status): users' profiles are read with one query
+    # and RDA is calculated locally for all of them at once with array operations
+    results: dict[str, dict[str, Any]] = {}
+    object_ids: dict[str, ObjectId] = {}
+    for user_id in user_ids:
+        try:
+            object_ids[user_id] = ObjectId(user_id)
+        except (InvalidId, TypeError):
+            results[user_id] = {"error": f"Invalid user id: {user_id}", "status": 400}
+    profiles: dict[str, dict[str, Any]] = {
+        str(profile.pop("_id")): profile
+        for profile in UserInfo.objects(pk__in=list(object_ids.values())).only(*RDA_PROFILE_FIELDS).as_pymongo()
+    }
+    found_ids: list[str] = [user_id for user_id in object_ids.keys() if user_id in profiles]
+    time_start: float = time.time()
+    rdas: list[dict[str, Any]] = compute_batch([{field: profiles[user_id].get(field) for field in RDA_PROFILE_FIELDS} for user_id in found_ids])
+    RDA_LATENCY.labels("local_batch").observe(time.time() - time_start)
+    for user_id, rda in zip(found_ids, rdas):
+        results[user_id] = {"error": rda["error"], "status": 400} if "error" in rda else {"daily_rda": rda, "status": 200}
+    return {user_id: results.get(user_id, {"error": "User not found", "status": 404}) for user_id in user_ids}
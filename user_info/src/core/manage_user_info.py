@@ -2,9 +2,15 @@ import os
 from typing import Any
 import requests
 from bson import ObjectId
+from bson.errors import InvalidId
+from mongoengine import Q
+from user_info.src.core import service_clients
+from shared.src.core.http_client import HTTP_CLIENT
 from user_info.src.models.converters.user_info_converter import UserInfoConverter
 from user_info.src.models.entities.user_info import UserInfo
 
+USER_INFO_FIELDS: list[str] = ["username", "age", "height", "weight", "gender", "activity_level"]
+
 def check_serverless():
     url: str = f"{os.environ['SERVERLESS_NAMESPACE_URL']}/actions/health"
     params: dict[str, Any] = {
@@ -15,7 +21,7 @@ def check_serverless():
         "Content-Type": "application/json",
         "Authorization": f"Basic {os.environ['SERVERLESS_AUTH']}",
     }
-    response: requests.Response = requests.post(url=url, params=params, headers=headers, data="")
+    response: requests.Response = HTTP_CLIENT.post(url, "serverless", params=params, headers=headers, data="")
     if not response.ok:
         raise Exception(f"Error while executing serverless function: {response.status_code=}, {response.text=}")
 
@@ -39,12 +45,38 @@ def get_user_info_by_username(username: str) -> UserInfo | None:
     else:
         return None
 
+def get_user_infos(ids: list[str], usernames: list[str]) -> dict[str, dict[str, dict[str, Any]]]:
+    # Result (user or error, with status) of each id and username, resolved with one query
+    # that only reads the public fields as raw documents
+    id_results: dict[str, dict[str, Any]] = {}
+    object_ids: dict[str, ObjectId] = {}
+    for id in ids:
+        try:
+            object_ids[id] = ObjectId(id)
+        except (InvalidId, TypeError):
+            # Same entry as the batch daily RDA endpoint
+            id_results[id] = {"error": f"Invalid user id: {id}", "status": 400}
+    by_id: dict[str, dict[str, Any]] = {}
+    by_username: dict[str, dict[str, Any]] = {}
+    if object_ids or usernames:
+        documents: list[dict[str, Any]] = list(UserInfo.objects(Q(pk__in=list(object_ids.values())) | Q(username__in=usernames)).only(*USER_INFO_FIELDS).as_pymongo())
+        for document in documents:
+            user_dict: dict[str, Any] = UserInfoConverter.document_to_dict(document)
+            by_id[user_dict["id"]] = user_dict
+            by_username[user_dict["username"]] = user_dict
+    not_found: dict[str, Any] = {"error": "User not found", "status": 404}
+    for id, object_id in object_ids.items():
+        found: dict[str, Any] | None = by_id.get(str(object_id))
+        id_results[id] = {"user_info": found, "status": 200} if found is not None else not_found
+    return {
+        "ids": {id: id_results[id] for id in ids},
+        "usernames": {username: {"user_info": by_username[username], "status": 200} if username in by_username else not_found for username in usernames},
+    }
+
 def delete_user(user: UserInfo):
 
     # Delete all user's logged items
-    response: requests.Response = requests.delete(f"{os.environ['BACKEND_URL']}/api/v1/logged_item/user/{str(user.pk)}")
-    if not response.ok:
-        raise Exception(f"Failed to delete user's logged items: {response.status_code=}, {response.text=}")
+    service_clients.LOGGED_ITEM_CLIENT.delete_user_items(str(user.pk))
     # Delete user
     return user.delete()
 
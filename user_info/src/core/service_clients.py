@@ -0,0 +1,39 @@
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+from shared.src.core.http_client import HTTP_CLIENT
+import requests
+import os
+
+SERVICE_TRANSPORTS: list[str] = ["http", "inprocess"]
+
+load_dotenv()
+
+class LoggedItemClient(ABC):
+    @abstractmethod
+    def delete_user_items(self, user_id: str):
+        # Raises an exception if user's logged items could not be deleted
+        ...
+
+class HttpLoggedItemClient(LoggedItemClient):
+    def delete_user_items(self, user_id: str):
+        response: requests.Response = HTTP_CLIENT.delete(f"{os.environ['BACKEND_URL']}/api/v1/logged_item/user/{user_id}", "logged_item")
+        if not response.ok:
+            raise Exception(f"Failed to delete user's logged items: {response.status_code=}, {response.text=}")
+
+class InProcessLoggedItemClient(LoggedItemClient):
+    # Calls logged_item's core directly (services share one process)
+    def delete_user_items(self, user_id: str):
+        from logged_item.src.core.manage_logged_item import delete_logged_items_for_user
+        delete_logged_items_for_user(user_id)
+
+def make_client(transport: str) -> LoggedItemClient:
+    if transport not in SERVICE_TRANSPORTS:
+        raise Exception(f"Invalid service transport: {transport}, allowed values: {SERVICE_TRANSPORTS}")
+    return InProcessLoggedItemClient() if transport == "inprocess" else HttpLoggedItemClient()
+
+LOGGED_ITEM_CLIENT: LoggedItemClient = make_client(os.environ.get("SERVICE_TRANSPORT", "http").lower())
+
+def use_transport(transport: str):
+    # Used by the combined deployment (api.py), where all services share one process
+    global LOGGED_ITEM_CLIENT
+    LOGGED_ITEM_CLIENT = make_client(transport)
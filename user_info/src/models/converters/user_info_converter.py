@@ -26,3 +26,15 @@ class UserInfoConverter():
             "activity_level": entity.activity_level.value,
         }
 
+    @staticmethod
+    def document_to_dict(document: dict[str, Any]) -> dict[str, Any]:
+        # Same as to_dict, for raw documents (e.g. from as_pymongo(), where enums are stored as their values)
+        return {
+            "id": str(document["_id"]),
+            "username": document.get("username"),
+            "age": document.get("age"),
+            "height": document.get("height"),
+            "weight": document.get("weight"),
+            "gender": document.get("gender"),
+            "activity_level": document.get("activity_level"),
+        }
@@ -20,4 +20,7 @@ class UserInfo(me.Document):
     weight: float = me.FloatField()
     gender: Gender = me.EnumField(Gender)
     activity_level: ActivityLevel = me.EnumField(ActivityLevel)
+    # Daily RDA memoized for the profile (age, height, weight, gender, activity level) it was calculated for
+    rda_fingerprint: str | None = me.StringField()
+    daily_rda: dict[str, float] = me.DictField()
 
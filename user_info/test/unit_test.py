@@ -1,12 +1,23 @@
 from typing import Any
 from flask.testing import FlaskClient
 from user_info.src.api.v1.api import app
+from user_info.src.models.entities.user_info import UserInfo
+from user_info.src.models.converters.user_info_converter import UserInfoConverter
+from shared.src.core.http_client import HTTP_CLIENT
+from shared.test.query_plan import assert_no_collscan
+from user_info.src.core import daily_rda
+from user_info.src.core.daily_rda import FallbackRdaBackend, LocalRdaBackend, RdaBackend, ServerlessRdaBackend, make_rda_backend, rda_arguments
+from serverless.get_daily_rda import ActivityLevel, Gender, main as compute_daily_rda
+from serverless.get_daily_rda_batch import compute_batch
 import pytest
 from pymongo.synchronous.database import Database
 from pymongo.synchronous.mongo_client import MongoClient
-from mongoengine import disconnect_all, connect
+from mongoengine import Q, disconnect_all, connect
 from dotenv import load_dotenv
+import gevent
 import os
+import requests
+import time
 from unittest import mock
 
 app.config["TESTING"] = True
@@ -127,8 +138,8 @@ def test_user_deletion(client: FlaskClient, database: Database):
         assert resp.json[prop] == value
     assert resp.json["id"] == user_id
 
-    # Mocking the requests.delete to simulate deleting logged_item entities
-    with mock.patch("requests.delete") as mock_delete:
+    # Mocking HTTP_CLIENT.delete to simulate deleting logged_item entities
+    with mock.patch.object(HTTP_CLIENT, "delete") as mock_delete:
         # Delete user
         # Simulate a successful deletion response from the logged_item service
         mock_delete.return_value.status_code = 200
@@ -140,7 +151,7 @@ def test_user_deletion(client: FlaskClient, database: Database):
         assert resp.status_code == 200
         assert resp.json["message"]
         # Verify that the mock delete was called with the correct URL
-        mock_delete.assert_called_once_with(f"{os.environ['BACKEND_URL']}/api/v1/logged_item/user/{user_id}")
+        mock_delete.assert_called_once_with(f"{os.environ['BACKEND_URL']}/api/v1/logged_item/user/{user_id}", "logged_item")
 
         # Try to re-delete user (it should be non-existent at this point)
         resp = client.delete(f"/api/v1/user_info/id/{user_id}")
@@ -190,3 +201,117 @@ def test_daily_rda(client: FlaskClient, database: Database):
     for key in required_keys:
         assert 0.0 < float(resp.json[key]) 
 
+def test_daily_rda_batch_matches_scalar():
+    profiles: list[dict[str, Any]] = [
+        {"age": age, "height": height, "weight": weight, "gender": gender.value, "activity_level": activity_level.value}
+        for age in [18, 35, 67, 90]
+        for height in [150, 172.5, 201]
+        for weight in [45, 80.3, 140]
+        for gender in Gender
+        for activity_level in ActivityLevel
+    ]
+    profiles.append({**profiles[0], "gender": "x"})
+    assert compute_batch(profiles) == [compute_daily_rda(profile) for profile in profiles]
+    # Non-finite profiles (which make the scalar function raise) get an error instead of garbage values
+    invalid: list[dict[str, Any]] = [{**profiles[0], "height": "nan"}, {**profiles[0], "weight": "inf"}, {**profiles[0], "weight": 1e308}]
+    results: list[dict[str, Any]] = compute_batch(invalid + profiles[:1])
+    assert all("error" in result for result in results[:3])
+    assert results[3] == compute_daily_rda(profiles[0])
+
+def test_daily_rda_batch(client: FlaskClient, database: Database):
+    user_ids: list[str] = []
+    for username, weight in [("janez", 80), ("micka", 60)]:
+        resp = client.post(f"/api/v1/user_info/", json={**TEST_USER, "username": username, "weight": weight})
+        assert resp.json is not None
+        user_ids.append(resp.json["user_info"]["id"])
+    missing_id: str = "6770566535c6d727a838e434"
+    resp = client.post(f"/api/v1/user_info/daily_rda/batch", json={"ids": user_ids + [missing_id, "invalid"]})
+    assert resp.json is not None
+    assert resp.status_code == 200
+    results: dict[str, dict[str, Any]] = resp.json["daily_rda"]
+    for user_id in user_ids:
+        assert results[user_id]["status"] == 200
+        assert results[user_id]["daily_rda"] == compute_daily_rda(rda_arguments(UserInfo.objects(pk=user_id).first()))
+    assert results[missing_id]["status"] == 404
+    assert results["invalid"]["status"] == 400
+
+def test_daily_rda_memoized(client: FlaskClient, database: Database):
+    resp = client.post(f"/api/v1/user_info/", json=TEST_USER.copy())
+    assert resp.json is not None
+    user_id: str = resp.json["user_info"]["id"]
+    with mock.patch.object(LocalRdaBackend, "compute", wraps=LocalRdaBackend().compute) as mock_compute:
+        # Only the first request calculates RDA
+        for _ in range(3):
+            resp = client.get(f"/api/v1/user_info/daily_rda/{user_id}")
+            assert resp.status_code == 200
+        assert mock_compute.call_count == 1
+        calories: float = resp.json["calories"]
+        # Changing the profile invalidates memoized RDA
+        UserInfo.objects(pk=user_id).update_one(set__weight=TEST_USER["weight"] + 10)
+        resp = client.get(f"/api/v1/user_info/daily_rda/{user_id}")
+        assert resp.json is not None
+        assert mock_compute.call_count == 2
+        assert resp.json["calories"] > calories
+
+def test_daily_rda_fallback(client: FlaskClient, database: Database):
+    resp = client.post(f"/api/v1/user_info/", json=TEST_USER.copy())
+    assert resp.json is not None
+    user_id: str = resp.json["user_info"]["id"]
+    expected: dict[str, Any] = LocalRdaBackend().get(rda_arguments(UserInfo.objects(pk=user_id).first()))
+    # Serverless function times out, so RDA is calculated locally
+    backend: RdaBackend = make_rda_backend("serverless_with_fallback")
+    with mock.patch.object(daily_rda, "RDA_BACKEND", backend), mock.patch.object(HTTP_CLIENT, "post", side_effect=requests.exceptions.ReadTimeout()) as mock_post:
+        resp = client.get(f"/api/v1/user_info/daily_rda/{user_id}")
+        assert resp.json is not None
+        assert resp.status_code == 200
+        assert resp.json == expected
+        assert mock_post.call_count == 1
+
+def test_serverless_rda_deadline():
+    args: dict[str, Any] = {key: TEST_USER[key] for key in ["age", "height", "weight", "gender", "activity_level"]}
+
+    def slow_post(*args: Any, **kwargs: Any):
+        # Every read arrives in time, but the whole response takes too long
+        gevent.sleep(1)
+
+    backend: RdaBackend = FallbackRdaBackend(ServerlessRdaBackend(0.1), LocalRdaBackend())
+    time_start: float = time.time()
+    with mock.patch.object(HTTP_CLIENT, "post", side_effect=slow_post):
+        assert backend.get(args) == LocalRdaBackend().get(args)
+    assert time.time() - time_start < 0.5
+
+def test_user_batch(client: FlaskClient, database: Database):
+    user_ids: dict[str, str] = {}
+    for username in ["janez", "micka", "franc"]:
+        resp = client.post(f"/api/v1/user_info/", json={**TEST_USER, "username": username})
+        assert resp.json is not None
+        user_ids[username] = resp.json["user_info"]["id"]
+    missing_id: str = "6770566535c6d727a838e434"
+    # Mixed ids and usernames, including unknown ones
+    resp = client.post(f"/api/v1/user_info/batch", json={"ids": [user_ids["janez"], missing_id, "invalid"], "usernames": ["micka", "nobody"]})
+    assert resp.json is not None
+    assert resp.status_code == 200
+    assert resp.json["ids"][user_ids["janez"]]["status"] == 200
+    check_user_match(TEST_USER, {"message": "ok", "user_info": resp.json["ids"][user_ids["janez"]]["user_info"]})
+    assert resp.json["ids"][missing_id]["status"] == 404
+    # Same as the batch daily RDA endpoint
+    assert resp.json["ids"]["invalid"]["status"] == 400
+    assert resp.json["ids"]["invalid"]["error"] == "Invalid user id: invalid"
+    assert resp.json["usernames"]["micka"]["user_info"]["id"] == user_ids["micka"]
+    assert resp.json["usernames"]["nobody"]["status"] == 404
+    # Same through query parameters
+    resp = client.get(f"/api/v1/user_info/batch?ids={user_ids['franc']},{missing_id}&usernames=janez")
+    assert resp.json is not None
+    assert resp.json["ids"][user_ids["franc"]]["user_info"]["username"] == "franc"
+    assert resp.json["ids"][missing_id]["status"] == 404
+    assert resp.json["usernames"]["janez"]["user_info"]["id"] == user_ids["janez"]
+
+def test_indexes_used(database: Database):
+    UserInfo.ensure_indexes()
+    user: UserInfo = UserInfoConverter.to_entity(TEST_USER.copy())
+    user.save()
+    # User lookups by id and by username
+    assert_no_collscan(UserInfo.objects(pk=user.pk).explain())
+    assert_no_collscan(UserInfo.objects(username=TEST_USER["username"]).explain())
+    # Batch lookup by ids and usernames
+    assert_no_collscan(UserInfo.objects(Q(pk__in=[user.pk]) | Q(username__in=[TEST_USER["username"]])).explain())